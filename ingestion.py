@@ -0,0 +1,331 @@
+"""This module stores notification parsing, ordering and queueing"""
+import heapq
+import itertools
+import json
+import threading
+import Queue
+from scheduling import monotonic
+
+
+def iter_sections(chunks, buffer_size):
+    """Parses JSON object of arrays incrementally, so whole document
+    is never held in memory. Only unparsed remainder of data is buffered.
+
+    Parameters:
+    chunks (iterable): Chunks of JSON document
+    buffer_size (int): Most characters buffered for a single item
+
+    Yields:
+    tuple: Section name and item in document order
+
+    Raises:
+    ValueError: If document is malformed, incomplete
+    or item does not fit into buffer
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    state = 'start'
+    section = None
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos < len(buf):
+            char = buf[pos]
+            if state == 'start':
+                if char != '{':
+                    raise ValueError('Expected object at %d' % pos)
+                (pos, state) = (pos + 1, 'key')
+                continue
+            if state in ('key', 'item') and char == ',':
+                pos += 1
+                continue
+            if state == 'key' and char == '}':
+                return
+            if state == 'item' and char == ']':
+                (pos, state) = (pos + 1, 'key')
+                continue
+            if state == 'colon':
+                if char != ':':
+                    raise ValueError('Expected colon at %d' % pos)
+                (pos, state) = (pos + 1, 'value')
+                continue
+            if state == 'value' and char == '[':
+                (pos, state) = (pos + 1, 'item')
+                continue
+            try:
+                (value, end) = decoder.raw_decode(buf, pos)
+            except ValueError:
+                end = len(buf)
+            # number at the end of buffered data may continue in next chunk,
+            # so value is accepted only when it's delimiter is buffered
+            delimiter = end
+            while delimiter < len(buf) and buf[delimiter] in ' \t\r\n':
+                delimiter += 1
+            if (delimiter < len(buf) and
+                    buf[delimiter] in (':' if state == 'key' else ',]}')):
+                pos = end
+                if state == 'key':
+                    (section, state) = (value, 'colon')
+                elif state == 'item':
+                    yield (section, value)
+                else:
+                    state = 'key'
+                continue
+        (buf, pos) = (buf[pos:], 0)
+        if len(buf) > buffer_size:
+            raise ValueError('Item does not fit into %d buffer' % buffer_size)
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError('Unexpected end of data')
+        buf += chunk
+
+
+class ReorderBuffer(object):
+    """This class represents reorder buffer which releases async responses
+    in timestamp order across batches. Response is released once newer
+    timestamp exceeds its own by lateness, after it was held for lateness
+    seconds or when buffer overflows. Responses are kept in a heap,
+    so reordering costs O(log k) per response.
+
+    Parameters:
+    lateness (float): Seconds response may arrive after newer ones
+    size (int): Most responses held
+    """
+
+    def __init__(self, lateness, size):
+        self.lateness = lateness
+        self.size = size
+        self.heap = []
+        self.counter = itertools.count()
+        self.newest = None
+        self.released = None
+        self.late = 0
+        self.overflow = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, responses):
+        """Adds responses and releases those which watermark has passed.
+        Response older than already released one is released at once.
+
+        Parameters:
+        responses (list): Async responses
+
+        Returns:
+        list: Released async responses
+        """
+        now = monotonic()
+        released = []
+        with self.lock:
+            for response in responses:
+                timestamp = response['timestamp']
+                if self.released is not None and timestamp < self.released:
+                    self.late += 1
+                    released.append(response)
+                    continue
+                heapq.heappush(self.heap,
+                               (timestamp, next(self.counter), now, response))
+                if self.newest is None or timestamp > self.newest:
+                    self.newest = timestamp
+            if self.heap:
+                watermark = self.newest - self.lateness
+                released += self._release(lambda entry: entry[0] <= watermark)
+        return released
+
+    def flush(self, force=False):
+        """Releases responses which were held for lateness seconds.
+
+        Parameters:
+        force (bool): Whether all responses are released (optional)
+
+        Returns:
+        list: Released async responses
+        """
+        deadline = monotonic() - self.lateness
+        with self.lock:
+            return self._release(
+                lambda entry: force or entry[2] <= deadline)
+
+    def _release(self, ready):
+        """Pops responses from heap while they are ready
+        or buffer is over its size"""
+        released = []
+        while self.heap and (ready(self.heap[0]) or
+                             len(self.heap) > self.size):
+            entry = heapq.heappop(self.heap)
+            if not ready(entry):
+                self.overflow += 1
+            self.released = entry[0]
+            released.append(entry[3])
+        return released
+
+
+class DuplicateFilter(object):
+    """This class represents filter of recently seen keys.
+    Keys are kept in two sets, current set replaces previous one
+    when it is full, so at least last size keys are remembered
+    and at most twice as many are held.
+
+    Parameters:
+    size (int): Number of keys in each set
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.current = set()
+        self.previous = set()
+        self.lock = threading.Lock()
+
+    def seen(self, key):
+        """Checks whether key was seen and remembers it.
+
+        Parameters:
+        key (object): Hashable key
+
+        Returns:
+        bool: Whether key was seen before
+        """
+        with self.lock:
+            if key in self.current or key in self.previous:
+                return True
+            self.current.add(key)
+            if len(self.current) >= self.size:
+                self.previous = self.current
+                self.current = set()
+            return False
+
+    def unique(self, items, key):
+        """Filters out items whose key was seen and remembers keys of others.
+
+        Parameters:
+        items (list): Items to filter
+        key (function): Function which returns hashable key of item
+
+        Returns:
+        list: Items which were not seen before
+        """
+        return [item for item in items if not self.seen(key(item))]
+
+
+class IngestionQueue(object):
+    """This class represents bounded queue of notification batches
+    which are processed by pool of worker threads. When queue is full,
+    'block' policy makes producer wait and 'drop-oldest' policy
+    discards the oldest queued batch.
+
+    Parameters:
+    handler (function): Function which processes a batch
+    workers (int): Number of worker threads
+    size (int): Queue capacity
+    policy (str): 'block' or 'drop-oldest' (optional)
+    """
+
+    def __init__(self, handler, workers, size, policy='block'):
+        self.handler = handler
+        self.workers = workers
+        self.policy = policy
+        self.queue = Queue.Queue(size)
+        self.dropped = 0
+        self.high_watermark = 0
+        self.threads = []
+
+    def depth(self):
+        """Returns number of queued batches.
+
+        Returns:
+        int: Queue depth
+        """
+        return self.queue.qsize()
+
+    def start(self):
+        """Starts worker threads."""
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def wait(self, timeout=None):
+        """Blocks until all queued batches are processed.
+
+        Parameters:
+        timeout (float): Most seconds to wait, None waits forever (optional)
+
+        Returns:
+        bool: Whether all queued batches were processed
+        """
+        if timeout is None:
+            self.queue.join()
+            return True
+        deadline = monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, wait=False):
+        """Stops worker threads after queued batches are processed.
+        When called from a worker, stop signal is queued in background,
+        so the worker does not wait for itself.
+
+        Parameters:
+        wait (bool): Whether to wait until workers exit (optional)
+        """
+        threads = self.threads
+        self.threads = []
+
+        def signal():
+            for _ in threads:
+                self.queue.put(None)
+        if threading.current_thread() in threads:
+            thread = threading.Thread(target=signal)
+            thread.daemon = True
+            thread.start()
+        else:
+            signal()
+            if wait:
+                for thread in threads:
+                    thread.join()
+
+    def put(self, batch):
+        """Queues batch according to queue policy.
+
+        Parameters:
+        batch (object): Notification data
+        """
+        if self.policy == 'drop-oldest':
+            while True:
+                try:
+                    self.queue.put_nowait(batch)
+                    break
+                except Queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.queue.task_done()
+                        self.dropped += 1
+                    except Queue.Empty:
+                        pass
+        else:
+            self.queue.put(batch)
+        self.high_watermark = max(self.high_watermark, self.queue.qsize())
+
+    def _work(self):
+        """Processes queued batches until stopped"""
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                self.queue.task_done()
+                break
+            try:
+                self.handler(batch)
+            except Exception as ex:
+                print('Failed to process notification: ', ex)
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,212 @@
+"""This module stores request rate limiter and circuit breaker"""
+import collections
+import threading
+import requests
+from scheduling import monotonic
+
+
+class TokenBucket(object):
+    """This class represents token bucket rate limiter.
+    Bucket is refilled with given rate and holds at most burst tokens.
+
+    Parameters:
+    rate (float): Tokens added per second
+    burst (int): Bucket capacity (optional)
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.timestamp = monotonic()
+
+    def refill(self):
+        """Adds tokens accumulated since last refill.
+
+        Returns:
+        float: Tokens available
+        """
+        now = monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+        return self.tokens
+
+    def take(self):
+        """Takes one token if it is available.
+
+        Returns:
+        float: 0 if token was taken, otherwise seconds until next token
+        """
+        if self.refill() >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionTimeout(requests.Timeout):
+    """Raised when request limiter does not admit request in time."""
+
+
+class RequestLimiter(object):
+    """This class admits device requests under global token bucket rate limit
+    and per-endpoint cap of outstanding transactions. Requests which can not
+    be admitted wait in a queue which is served round-robin across endpoints.
+
+    Parameters:
+    rate (float): Requests per second (optional)
+    burst (int): Requests allowed in a burst (optional)
+    max_in_flight (int): Outstanding transactions per endpoint (optional)
+    """
+
+    def __init__(self, rate=None, burst=1, max_in_flight=None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_in_flight = max_in_flight
+        self.in_flight = {}
+        self.waiting = collections.OrderedDict()
+        self.condition = threading.Condition()
+
+    def _eligible(self, endpoint):
+        """Checks if endpoint is below it's in-flight cap"""
+        return (endpoint is None or self.max_in_flight is None or
+                self.in_flight.get(endpoint, 0) < self.max_in_flight)
+
+    def _next_ticket(self):
+        """Returns ticket which is next in fair queue order"""
+        for endpoint, tickets in self.waiting.items():
+            if self._eligible(endpoint):
+                return tickets[0]
+        return None
+
+    def acquire(self, endpoint=None, transaction=True, timeout=None):
+        """Blocks until request can be sent.
+
+        Parameters:
+        endpoint (str): Endpoint name (optional)
+        transaction (bool): Whether request occupies in-flight slot (optional)
+        timeout (float): Most seconds to wait, None waits forever (optional)
+
+        Raises:
+        AdmissionTimeout: If request is not admitted within timeout
+        """
+        ticket = object()
+        key = endpoint if transaction else None
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.condition:
+            self.waiting.setdefault(key, collections.deque()).append(ticket)
+            while True:
+                wait = None
+                if self._next_ticket() is ticket:
+                    wait = self.bucket.take() if self.bucket else 0.0
+                    if not wait:
+                        break
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self._leave(key, ticket)
+                        raise AdmissionTimeout(
+                            'Request to %s was not admitted in time' %
+                            endpoint)
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.condition.wait(wait)
+            self._leave(key, ticket)
+            if key is not None:
+                self.in_flight[key] = self.in_flight.get(key, 0) + 1
+
+    def _leave(self, key, ticket):
+        """Removes ticket from fair queue and wakes waiting requests"""
+        tickets = self.waiting.pop(key)
+        if tickets[0] is ticket:
+            tickets.popleft()
+        else:
+            tickets.remove(ticket)
+        if tickets:
+            self.waiting[key] = tickets
+        self.condition.notify_all()
+
+    def try_acquire(self, endpoint):
+        """Admits transaction request without waiting.
+        Request is not admitted while other requests of endpoint wait.
+
+        Parameters:
+        endpoint (str): Endpoint name
+
+        Returns:
+        tuple: Whether request was admitted and seconds until rate limit
+        admits it or None if endpoint is at in-flight cap
+        """
+        with self.condition:
+            if endpoint in self.waiting or not self._eligible(endpoint):
+                return (False, None)
+            wait = self.bucket.take() if self.bucket else 0.0
+            if wait:
+                return (False, wait)
+            self.in_flight[endpoint] = self.in_flight.get(endpoint, 0) + 1
+            return (True, None)
+
+    def release(self, endpoint):
+        """Frees in-flight slot of endpoint.
+
+        Parameters:
+        endpoint (str): Endpoint name
+        """
+        with self.condition:
+            count = self.in_flight.get(endpoint, 0) - 1
+            if count > 0:
+                self.in_flight[endpoint] = count
+            else:
+                self.in_flight.pop(endpoint, None)
+            self.condition.notify_all()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised when circuit breaker rejects request while server is down."""
+
+
+class CircuitBreaker(object):
+    """This class represents circuit breaker of Punica server connection.
+    Circuit opens after threshold of consecutive failures and rejects
+    requests until reset timeout passes. Then single probe request is let
+    through (half-open) which either closes or reopens the circuit.
+
+    Parameters:
+    threshold (int): Consecutive failures which open the circuit
+    reset_timeout (float): Seconds before probe request is allowed (optional)
+    """
+
+    def __init__(self, threshold, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Checks if request can be sent.
+
+        Returns:
+        bool: True if request is allowed
+        """
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if (self.state == 'open' and
+                    monotonic() - self.opened_at >= self.reset_timeout):
+                self.state = 'half-open'
+                return True
+            return False
+
+    def success(self):
+        """Records successful request and closes the circuit."""
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def failure(self):
+        """Records failed request and opens the circuit if needed."""
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half-open' or self.failures >= self.threshold:
+                self.state = 'open'
+                self.opened_at = monotonic()
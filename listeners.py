@@ -0,0 +1,236 @@
+"""This module stores notification listeners"""
+import asynchat
+import asyncore
+import BaseHTTPServer
+import collections
+import errno
+import json
+import socket
+import SocketServer
+import sys
+
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT',
+                       15 if sys.platform.startswith('linux') else None)
+
+
+class NotificationHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """This class handles HTTP/1.1 notification requests pushed by
+    Punica server. Request body is read by Content-Length or chunked
+    transfer encoding. Request is acknowledged before notification
+    data is handed to service, connection is kept alive.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        """Handles PUT notification request"""
+        try:
+            body = self._read_body()
+            data = json.loads(body) if body else None
+        except ValueError:
+            self._reply(400)
+            return
+        self._reply(204)
+        if data:
+            self.server.service.receive_notification(data)
+
+    do_POST = do_PUT
+
+    def _read_body(self):
+        """Reads request body.
+
+        Returns:
+        str: Request body
+        """
+        encoding = self.headers.get('Transfer-Encoding', '')
+        if encoding.lower() != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(';')[0], 16)
+            if size == 0:
+                break
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+        while self.rfile.readline().strip():
+            pass
+        return ''.join(chunks)
+
+    def _reply(self, status):
+        """Sends response without body"""
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        """Disables logging of every request"""
+        pass
+
+
+class NotificationServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+    """This class represents notification listener which handles
+    every connection in it's own thread.
+
+    Parameters:
+    address (tuple): Host and port
+    service (object): Service which receives notifications
+    reuse_port (bool): Whether several processes can bind the same port (optional)
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, service, reuse_port=False):
+        self.service = service
+        self.reuse_port = reuse_port
+        BaseHTTPServer.HTTPServer.__init__(self, address, NotificationHandler)
+
+    def server_bind(self):
+        """Sets SO_REUSEPORT before binding if port is shared"""
+        if self.reuse_port:
+            if SO_REUSEPORT is None:
+                raise socket.error('SO_REUSEPORT is not supported')
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        BaseHTTPServer.HTTPServer.server_bind(self)
+
+    def handle_error(self, request, client_address):
+        """Ignores connections closed by client, reports other errors"""
+        ex = sys.exc_info()[1]
+        if isinstance(ex, socket.error) and ex.errno in (
+                errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED):
+            return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+class AsyncNotificationConnection(asynchat.async_chat):
+    """This class represents connection of asyncore notification listener.
+    HTTP/1.1 requests are parsed incrementally, body is read by
+    Content-Length or chunked transfer encoding. Parsed notification data
+    is queued for the listener, which hands it to service, and request
+    is acknowledged.
+
+    Parameters:
+    sock (object): Connection socket
+    pending (object): Deque of parsed notification data of the listener
+    socket_map (dict): asyncore socket map
+    """
+
+    def __init__(self, sock, pending, socket_map):
+        asynchat.async_chat.__init__(self, sock, socket_map)
+        self.pending = pending
+        self.incoming = []
+        self.chunks = []
+        self.close_after = False
+        self.state = 'headers'
+        self.set_terminator('\r\n\r\n')
+
+    def collect_incoming_data(self, data):
+        """Buffers received data"""
+        self.incoming.append(data)
+
+    def found_terminator(self):
+        """Advances request parser when terminator is reached"""
+        data = ''.join(self.incoming)
+        self.incoming = []
+        if self.state == 'headers':
+            headers = {}
+            for line in data.split('\r\n')[1:]:
+                (name, _, value) = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            self.close_after = headers.get('connection', '').lower() == 'close'
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                self.state = 'chunk-size'
+                self.set_terminator('\r\n')
+            elif int(headers.get('content-length', 0)):
+                self.state = 'body'
+                self.set_terminator(int(headers['content-length']))
+            else:
+                self._handle_request('')
+        elif self.state == 'body':
+            self._handle_request(data)
+        elif self.state == 'chunk-size':
+            size = int(data.split(';')[0], 16)
+            if size:
+                self.state = 'chunk'
+                self.set_terminator(size + 2)
+            else:
+                self.state = 'trailers'
+        elif self.state == 'chunk':
+            self.chunks.append(data[:-2])
+            self.state = 'chunk-size'
+            self.set_terminator('\r\n')
+        elif not data:
+            self._handle_request(''.join(self.chunks))
+
+    def _handle_request(self, body):
+        """Queues notification data and acknowledges request"""
+        self.state = 'headers'
+        self.chunks = []
+        self.set_terminator('\r\n\r\n')
+        try:
+            data = json.loads(body) if body else None
+            status = '204 No Content'
+        except ValueError:
+            data = None
+            status = '400 Bad Request'
+        if data:
+            self.pending.append(data)
+        self.push('HTTP/1.1 %s\r\nContent-Length: 0\r\n\r\n' % status)
+        if self.close_after:
+            self.close_when_done()
+        self.initiate_send()
+
+
+class AsyncNotificationListener(asyncore.dispatcher):
+    """This class represents notification listener which is run by
+    asyncore event loop of the application, so no threads are used.
+    Notification data received by connections is queued and handed
+    to service at most drain_limit batches per loop pass, so processing
+    of a burst does not starve accepting and reading of other connections.
+    Batches which remain queued are handed over on following passes,
+    so event loop should be run with short timeout.
+
+    Parameters:
+    address (tuple): Host and port
+    service (object): Service which receives notifications
+    socket_map (dict): asyncore socket map
+    reuse_port (bool): Whether several processes can bind the same port (optional)
+    """
+
+    def __init__(self, address, service, socket_map, reuse_port=False):
+        asyncore.dispatcher.__init__(self, map=socket_map)
+        self.service = service
+        self.pending = collections.deque()
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        self.bind(address)
+        self.listen(128)
+
+    def handle_accept(self):
+        """Creates connection handler of accepted connection"""
+        pair = self.accept()
+        if pair is not None:
+            AsyncNotificationConnection(pair[0], self.pending, self._map)
+
+    def readable(self):
+        """Hands queued notification data to service on every loop pass"""
+        self.drain(self.service.config['drain_limit'])
+        return True
+
+    def drain(self, limit=None):
+        """Hands queued notification data to service.
+
+        Parameters:
+        limit (int): Most batches to hand over, None hands over all (optional)
+        """
+        count = 0
+        while self.pending and (limit is None or count < limit):
+            self.service.receive_notification(self.pending.popleft())
+            count += 1
+
+    def close(self):
+        """Hands remaining notification data to service and closes listener"""
+        self.drain()
+        asyncore.dispatcher.close(self)
@@ -1,10 +1,64 @@
 """This module demonstrates Service and Device"""
+# pylint: disable=too-many-lines
+import asyncore
+import collections
+import functools
 import json
+import multiprocessing
+import random
 import threading
-import socket
-import httplib
+import time
+import zlib
 import event_emitter
 import requests
+from ingestion import iter_sections, ReorderBuffer, DuplicateFilter, \
+    IngestionQueue
+from limits import RequestLimiter, CircuitBreaker, CircuitOpenError
+from listeners import NotificationServer, AsyncNotificationListener
+from scheduling import monotonic, ScheduledJob, Scheduler
+from stores import ResponseCache, EndpointRegistry, TransactionStore
+
+TIMEOUT_STATUS = 504
+
+DEFAULT_TRANSACTION_TIMEOUT = 60.0
+
+STREAM_CHUNK_SIZE = 65536
+
+ENDPOINT_EVENTS = {
+    'registrations': 'register',
+    'reg-updates': 'update',
+    'de-registrations': 'deregister'
+}
+
+
+def run_receiver(config, ready=None):
+    """Runs notification receiver process. Receiver has it's own service
+    which is set up by configured handler factory and binds notification
+    listener to shared port. Notification callback is registered once
+    by the service which started receivers, receivers do not run
+    the watchdog.
+
+    Parameters:
+    config (object): Configuration of service which started receivers
+    ready (object): Event which is set when listener is bound (optional)
+    """
+    service = Service(config)
+    service.configure({
+        'polling': False,
+        'receivers': 0,
+        'reuse_port': True,
+        'register_callback': False,
+        'watchdog': None
+    })
+    if config['handler_factory'] is not None:
+        config['handler_factory'](service)
+    service.start()
+    if ready is not None:
+        ready.set()
+    if service.server is not None:
+        service.server.join()
+    else:
+        asyncore.loop(timeout=0.1, map=service.socket_map)
 
 
 class Service(event_emitter.EventEmitter):
@@ -26,30 +80,248 @@ class Service(event_emitter.EventEmitter):
             'password': '',
             'interval': 1.234,
             'polling': True,
-            'port': 5725
+            'port': 5725,
+            'listen_host': '',
+            'callback_host': 'localhost',
+            'register_callback': True,
+            'reuse_port': False,
+            'receivers': 0,
+            'handler_factory': None,
+            'listener': 'thread',
+            'watchdog': None,
+            'rate_limit': None,
+            'rate_burst': 1,
+            'max_in_flight': None,
+            'acquire_timeout': 30.0,
+            'connect_timeout': 5.0,
+            'read_timeout': 30.0,
+            'retries': {'get': 0, 'put': 0, 'post': 0, 'delete': 0},
+            'retry_backoff': 0.1,
+            'retry_max_backoff': 5.0,
+            'breaker_threshold': None,
+            'breaker_timeout': 30.0,
+            'cache': False,
+            'cache_ttl': {'devices': 5.0, 'objects': 5.0, 'version': 60.0},
+            'registry': False,
+            'registry_resync': 300.0,
+            'coalesce_reads': False,
+            'transaction_timeout': None,
+            'expiry_interval': 1.0,
+            'resubscribe': False,
+            'workers': 0,
+            'queue_size': 100,
+            'queue_policy': 'block',
+            'dispatch_lanes': 0,
+            'pipeline': False,
+            'adaptive_interval': False,
+            'min_interval': 0.1,
+            'max_interval': 10.0,
+            'large_batch': 100,
+            'streaming': False,
+            'stream_buffer': 1048576,
+            'stream_batch': 100,
+            'drain_limit': 10,
+            'reorder_lateness': None,
+            'reorder_size': 1000,
+            'reorder_interval': 0.5,
+            'dedup_size': None,
+            'compression': False,
+            'compression_threshold': 1024
         }
+        self.limiter = None
+        self.breaker = None
+        self.dedup = None
         if opts is not None:
             self.configure(opts)
         self.authentication_token = ''
         self.token_validation = 3600
         self.pull_event = threading.Event()
         self.server_run = False
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.httpd = None
+        self.receivers = []
+        self.socket_map = {}
         self.authentication_event = threading.Event()
-        self.server = threading.Thread(target=self.create_server)
-        self.pull_timer = threading.Timer(
-            self.config['interval'], self._pull_and_process)
-        self.authenticate_timer = threading.Timer(
-            0.9 * self.token_validation, self._start_authenticate)
+        self.server = None
+        self.scheduler = Scheduler()
+        self.pull_timer = ScheduledJob(self._trigger_pull, ())
+        self.authenticate_timer = ScheduledJob(self._start_authenticate, ())
+        self.devices = {}
+        self.routes = TransactionStore()
+        self.held_notifications = {}
+        self.metrics = {
+            'conflated': 0,
+            'failovers': 0,
+            'duplicates': 0,
+            'poll_interval': self.config['interval']
+        }
+        self.metrics_lock = threading.Lock()
+        self.dispatch_state = threading.local()
+        self.held_requests = {}
+        self.held_lock = threading.Lock()
+        self.ingestion = None
+        self.lanes = []
+        self.pipeline = None
+        self.puller = None
+        self.resubscriber = None
+        self.resubscribing = set()
+        self.resubscribe_lock = threading.Lock()
+        self.expiry_event = threading.Event()
+        self.expiry_timer = ScheduledJob(self._expire_transactions, ())
+        self.reorder = None
+        self.reorder_timer = ScheduledJob(self._flush_reorder, ())
+        self.cache = ResponseCache()
+
+        def invalidate(name):
+            self.cache.invalidate('/endpoints', '/endpoints/' + name)
+        self.on('register', invalidate)
+        self.on('update', invalidate)
+        self.on('deregister', invalidate)
+        self.last_push = monotonic()
+        self.watchdog_event = threading.Event()
+        self.watchdog_timer = ScheduledJob(self._watch_pushes, ())
+        self.registry = EndpointRegistry()
+        self.registry_event = threading.Event()
+        self.registry_timer = ScheduledJob(self._resync_registry, ())
+
+        def registered(name):
+            if self.config['registry']:
+                self.registry.add(name)
+        self.on('register', registered)
+        self.on('update', registered)
+
+        def deregistered(name):
+            if self.config['registry']:
+                self.registry.remove(name)
+        self.on('deregister', deregistered)
 
     def configure(self, opts):
         """Configures service configuration with given options.
 
         Parameters:
         opts (object): Options object (optional)
+
+        Raises:
+        ValueError: If dispatch lanes are combined with multiple workers
         """
         for opt in opts:
             self.config[opt] = opts[opt]
+        # workers process batches concurrently, so lanes could receive
+        # events of later batch before events of earlier one
+        if self.config['workers'] > 1 and self.config['dispatch_lanes']:
+            raise ValueError('dispatch_lanes require at most one worker')
+        if set(opts) & set(['rate_limit', 'rate_burst', 'max_in_flight']):
+            self.limiter = None
+            if self.config['rate_limit'] or self.config['max_in_flight']:
+                self.limiter = RequestLimiter(self.config['rate_limit'],
+                                              self.config['rate_burst'],
+                                              self.config['max_in_flight'])
+        if (self.config['max_in_flight'] and
+                self.config['transaction_timeout'] is None):
+            self.config['transaction_timeout'] = DEFAULT_TRANSACTION_TIMEOUT
+        if set(opts) & set(['breaker_threshold', 'breaker_timeout']):
+            self.breaker = None
+            if self.config['breaker_threshold']:
+                self.breaker = CircuitBreaker(self.config['breaker_threshold'],
+                                              self.config['breaker_timeout'])
+        if 'dedup_size' in opts:
+            self.dedup = None
+            if self.config['dedup_size']:
+                self.dedup = DuplicateFilter(self.config['dedup_size'])
+
+    def acquire_slot(self, name, transaction=True):
+        """Waits until request to endpoint is admitted by rate limit
+        and in-flight cap. Does nothing if limits are not configured.
+
+        Parameters:
+        name (str): Endpoint name
+        transaction (bool): Whether request occupies in-flight slot (optional)
+
+        Raises:
+        AdmissionTimeout: If request is not admitted within acquire timeout
+        """
+        if self.limiter is not None:
+            self.limiter.acquire(name, transaction,
+                                 self.config['acquire_timeout'])
+
+    def release_slot(self, name):
+        """Frees endpoint's in-flight slot when transaction completes
+        and sends transaction requests held for the slot.
+
+        Parameters:
+        name (str): Endpoint name
+        """
+        if self.limiter is not None:
+            self.limiter.release(name)
+            self._send_held(name)
+
+    def submit_transaction(self, name, request, callback=None):
+        """Sends transaction request once it is admitted by request limits.
+        Request made by event handler is held if it can not be admitted
+        at once, so dispatch thread is not blocked. Held request is sent
+        when endpoint's slot is released. Other callers wait for the slot.
+
+        Parameters:
+        name (str): Endpoint name
+        request (function): Function which sends request and returns
+        async response id
+        callback (function): Transaction callback which is called with
+        status of failed held request (optional)
+
+        Returns:
+        str: async response id or None if request is held
+        """
+        if self.limiter is None:
+            return request()
+        if getattr(self.dispatch_state, 'active', False):
+            with self.held_lock:
+                (admitted, wait) = self.limiter.try_acquire(name)
+                if not admitted:
+                    self.held_requests.setdefault(
+                        name, collections.deque()).append((request, callback))
+            if admitted:
+                return request()
+            if wait is not None:
+                self.scheduler.schedule(wait, self._dispatch, name,
+                                        self._send_held, name)
+            return None
+        self.acquire_slot(name)
+        return request()
+
+    def _send_held(self, name):
+        """Sends transaction requests of endpoint which were held
+        while they can be admitted"""
+        if getattr(self.dispatch_state, 'sending', False):
+            return
+        self.dispatch_state.sending = True
+        try:
+            self._send_admitted(name)
+        finally:
+            self.dispatch_state.sending = False
+
+    def _send_admitted(self, name):
+        """Sends held requests of endpoint until one is not admitted"""
+        while True:
+            with self.held_lock:
+                held = self.held_requests.get(name)
+                if not held:
+                    return
+                (admitted, wait) = self.limiter.try_acquire(name)
+                if admitted:
+                    (request, callback) = held.popleft()
+                    if not held:
+                        del self.held_requests[name]
+            if not admitted:
+                if wait is not None:
+                    self.scheduler.schedule(wait, self._dispatch, name,
+                                            self._send_held, name)
+                return
+            try:
+                request()
+            except Exception as ex:
+                print('Failed to send held request: ', ex)
+                if callback is not None:
+                    callback(ex.args[0] if isinstance(ex, requests.HTTPError)
+                             else None, None)
 
     def start(self, opts=None):
         """(Re)starts authentication,
@@ -66,12 +338,57 @@ class Service(event_emitter.EventEmitter):
             if self.config['authentication']:
                 self.authentication_event.set()
                 self._start_authenticate()
+            if self.config['workers']:
+                self.ingestion = IngestionQueue(
+                    self._process_events, self.config['workers'],
+                    self.config['queue_size'], self.config['queue_policy'])
+                self.ingestion.start()
+            for _ in range(self.config['dispatch_lanes']):
+                lane = IngestionQueue(lambda task: task(), 1,
+                                      self.config['queue_size'])
+                lane.start()
+                self.lanes.append(lane)
+            if self.config['transaction_timeout'] is not None:
+                self.expiry_event.set()
+                self._expire_transactions()
+            if self.config['reorder_lateness'] is not None:
+                self.reorder = ReorderBuffer(self.config['reorder_lateness'],
+                                             self.config['reorder_size'])
+                self.reorder_timer = self.scheduler.schedule(
+                    self.config['reorder_interval'], self._flush_reorder)
+            if self.config['registry']:
+                self.registry_event.set()
+                self._resync_registry()
+            # notifications pushed to receiver processes do not reach
+            # this service, so watchdog can not tell whether they arrive
+            watchdog = self.config['watchdog'] and not self.config['receivers']
+            if self.config['polling'] or watchdog:
+                self.puller = IngestionQueue(lambda task: task(), 1, 1,
+                                             'drop-oldest')
+                self.puller.start()
             if self.config['polling']:
+                if self.config['pipeline']:
+                    self.pipeline = IngestionQueue(self._ingest, 1, 1)
+                    self.pipeline.start()
+                self.metrics['poll_interval'] = self.config['interval']
                 self.pull_event.set()
-                self._pull_and_process()
+                self.pull_timer = self.scheduler.schedule(
+                    0, self._trigger_pull)
             else:
-                self.server.start()
-                self.register_notification_callback()
+                if self.config['receivers']:
+                    self._start_receivers()
+                elif self.config['listener'] == 'asyncore':
+                    self.create_async_listener()
+                else:
+                    self.create_server()
+                    self.server.start()
+                if self.config['register_callback']:
+                    self.register_notification_callback()
+                if watchdog:
+                    self.last_push = monotonic()
+                    self.watchdog_event.set()
+                    self.watchdog_timer = self.scheduler.schedule(
+                        self.config['watchdog'], self._watch_pushes)
         except Exception as ex:
             raise ex
 
@@ -85,13 +402,67 @@ class Service(event_emitter.EventEmitter):
             self.authentication_event.clear()
             self.authenticate_timer.cancel()
 
+        if self.watchdog_event.is_set():
+            self.watchdog_event.clear()
+            self.watchdog_timer.cancel()
+
         if self.pull_event.is_set():
             self.pull_event.clear()
             self.pull_timer.cancel()
 
+        if self.puller is not None:
+            self.puller.stop(wait=not self._on_processing_thread())
+            self.puller = None
+
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+        if self.registry_event.is_set():
+            self.registry_event.clear()
+            self.registry_timer.cancel()
+
+        if self.expiry_event.is_set():
+            self.expiry_event.clear()
+            self.expiry_timer.cancel()
+
+        if self.reorder is not None:
+            reorder = self.reorder
+            self.reorder = None
+            self.reorder_timer.cancel()
+            self._deliver({}, self._conflate(reorder.flush(True)))
+
+        self.scheduler.stop()
+        with self.metrics_lock:
+            held = sorted(self.held_notifications.values(),
+                          key=lambda k: k.get('timestamp'))
+        for response in held:
+            self._release_notification(response.get('id'))
+
         if hasattr(self, 'server_run') and self.server_run:
             self.shut_down_server()
 
+        if self.ingestion is not None:
+            self.ingestion.stop()
+            self.ingestion = None
+
+        for lane in self.lanes:
+            lane.stop()
+        self.lanes = []
+
+        with self.resubscribe_lock:
+            if self.resubscriber is not None:
+                self.resubscriber.stop()
+                self.resubscriber = None
+            self.resubscribing.clear()
+
+    def _on_processing_thread(self):
+        """Checks whether caller runs on pipeline, worker or lane thread"""
+        current = threading.current_thread()
+        queues = [self.pipeline, self.ingestion] + self.lanes
+        return any(current in queue.threads for queue in queues
+                   if queue is not None)
+
     def get_devices(self):
         """Sends request to get all registered endpoints, that are
         currently registered to the LwM2M service.
@@ -100,11 +471,7 @@ class Service(event_emitter.EventEmitter):
         list: List of endpoints
         """
         try:
-            response = self.get('/endpoints')
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise requests.HTTPError(response.status_code)
+            return self.get_json('/endpoints', route='devices')
         except Exception as ex:
             raise ex
 
@@ -115,14 +482,41 @@ class Service(event_emitter.EventEmitter):
         str: Punica server's version
         """
         try:
-            response = self.get('/version')
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise requests.HTTPError(response.status_code)
+            return self.get_json('/version', route='version')
         except Exception as ex:
             raise ex
 
+    def get_json(self, path, status=200, route=None):
+        """Sends GET request and returns parsed response data.
+        If response cache is enabled and route has TTL,
+        response is served from cache until it expires or is invalidated
+        by register, update or deregister event.
+
+        Parameters:
+        path (str): Request path
+        status (int): Expected status code (optional)
+        route (str): Cache TTL key (devices, objects or version) (optional)
+
+        Returns:
+        object: Parsed response data
+        """
+        cached = self.config['cache'] and route is not None
+        if cached:
+            (hit, data) = self.cache.get(path)
+            if hit:
+                return data
+        generation = self.cache.generation
+        response = self.get(path)
+        if response.status_code == status:
+            data = response.json()
+            if cached:
+                self.cache.set(path, data,
+                               self.config['cache_ttl'].get(route, 0),
+                               generation)
+            return data
+        else:
+            raise requests.HTTPError(response.status_code)
+
     def pull_notification(self):
         """Sends request to get pending/queued notifications.
 
@@ -139,17 +533,190 @@ class Service(event_emitter.EventEmitter):
         except Exception as ex:
             raise ex
 
-    def _pull_and_process(self):
-        """Starts pulling and processing notifications"""
+    def stream_notification(self):
+        """Sends request to get pending/queued notifications
+        and parses response incrementally.
+
+        Yields:
+        tuple: Section name (registrations, reg-updates,
+        de-registrations, async-responses) and notification
+        in order of response
+        """
+        response = self.get('/notification/pull', stream=True)
+        try:
+            if response.status_code != 200:
+                raise requests.HTTPError(response.status_code)
+            chunks = response.iter_content(STREAM_CHUNK_SIZE)
+            for item in iter_sections(chunks, self.config['stream_buffer']):
+                yield item
+        finally:
+            response.close()
+
+    def _trigger_pull(self):
+        """Hands pull to pull thread, so scheduler thread is not blocked
+        by pull request and processing of pulled notifications"""
+        puller = self.puller
+        if self.pull_event.is_set() and puller is not None:
+            puller.put(functools.partial(self._pull_and_process, puller))
+
+    def _pull_and_process(self, puller=None):
+        """Starts pulling and processing notifications on pull thread.
+        Pulls are scheduled every interval from start of previous pull.
+        In pipeline mode pulled batch is handed to processing thread
+        once previous batch is processed, so next pull runs while
+        batch is processed. In streaming mode notifications are
+        grouped into small batches while response is read and each
+        batch is processed like a pulled batch.
+
+        Parameters:
+        puller (object): Pull thread queue which runs the pull (optional)
+        """
+        interval = self.config['interval']
+        pipeline = self.pipeline
+        started = monotonic()
         try:
-            self._process_events(self.pull_notification())
+            if self.config['streaming']:
+                count = 0
+                for batch in self._stream_batches():
+                    count += sum(len(items) for items in batch.values())
+                    self._hand_off(batch, pipeline)
+                interval = self._adapt_interval(count)
+                return
+            data = self.pull_notification()
+            interval = self._poll_interval(data)
+            self._hand_off(data, pipeline)
         except Exception as ex:
+            interval = self._poll_interval(None)
             print('Failed to pull notification: ', ex)
         finally:
-            self.pull_timer = threading.Timer(
-                self.config['interval'], self._pull_and_process)
-            if self.pull_event.is_set():
-                self.pull_timer.start()
+            if self.pull_event.is_set() and self.puller is puller:
+                delay = max(0, started + interval - monotonic())
+                self.pull_timer.cancel()
+                self.pull_timer = self.scheduler.schedule(
+                    delay, self._trigger_pull)
+
+    def _stream_batches(self):
+        """Groups streamed notifications into batches of at most
+        stream batch size in order of response.
+
+        Yields:
+        object: Notification data
+        """
+        batch = None
+        size = 0
+        for (section, item) in self.stream_notification():
+            if batch is None:
+                batch = {
+                    'registrations': [],
+                    'reg-updates': [],
+                    'de-registrations': [],
+                    'async-responses': []
+                }
+            batch.setdefault(section, []).append(item)
+            size += 1
+            if size >= self.config['stream_batch']:
+                yield batch
+                (batch, size) = (None, 0)
+        if batch is not None:
+            yield batch
+
+    def _hand_off(self, data, pipeline):
+        """Hands notification data to pipeline thread once previous batch
+        is processed or ingests it if pipeline is not used.
+        Waiting is abandoned when pulling is stopped."""
+        if pipeline is not None:
+            while not pipeline.wait(0.1):
+                if not self.pull_event.is_set():
+                    return
+            pipeline.put(data)
+        else:
+            self._ingest(data)
+
+    def _poll_interval(self, data):
+        """Chooses interval before next pull. In adaptive mode interval
+        doubles up to max interval after empty or failed pull, halves down
+        to min interval after non-empty pull and is zero after large pull.
+
+        Parameters:
+        data (object): Pulled notification data or None if pull failed
+
+        Returns:
+        float: Seconds before next pull
+        """
+        count = 0
+        if data is not None:
+            count = sum(len(data[section]) for section in [
+                'registrations', 'reg-updates',
+                'de-registrations', 'async-responses'])
+        return self._adapt_interval(count)
+
+    def _adapt_interval(self, count):
+        """Chooses interval before next pull from number of pulled
+        notifications. Interval is constant if adaptive mode is off.
+
+        Parameters:
+        count (int): Number of pulled notifications
+
+        Returns:
+        float: Seconds before next pull
+        """
+        if not self.config['adaptive_interval']:
+            return self.config['interval']
+        interval = self.metrics['poll_interval']
+        if count == 0:
+            interval = min(self.config['max_interval'],
+                           2 * max(interval, self.config['min_interval']))
+        elif count >= self.config['large_batch']:
+            interval = 0
+        else:
+            interval = max(self.config['min_interval'], interval / 2.0)
+        self.metrics['poll_interval'] = interval
+        return interval
+
+    def _watch_pushes(self):
+        """Checks that notifications are still pushed to listener.
+        After watchdog period without pushes notification pulling is
+        started and notification callback is re-registered.
+        Pulling is stopped once pushes resume."""
+        try:
+            silent = monotonic() - self.last_push >= self.config['watchdog']
+            if silent and not self.pull_event.is_set():
+                with self.metrics_lock:
+                    self.metrics['failovers'] += 1
+                self.pull_event.set()
+                self._trigger_pull()
+            elif not silent and self.pull_event.is_set():
+                self.pull_event.clear()
+                self.pull_timer.cancel()
+            if silent and self.config['register_callback']:
+                self.register_notification_callback()
+        except Exception as ex:
+            print('Failed to register notification callback: ', ex)
+        finally:
+            if self.watchdog_event.is_set():
+                self.watchdog_timer = self.scheduler.schedule_periodic(
+                    self.config['watchdog'], self._watch_pushes)
+
+    def _resync_registry(self):
+        """Fetches full endpoint list into local endpoint registry"""
+        try:
+            self.registry.begin_resync()
+            self.registry.finish_resync(self.get_json('/endpoints'))
+        except Exception as ex:
+            self.registry.journal = None
+            print('Failed to resync endpoint registry: ', ex)
+        finally:
+            if self.registry_event.is_set():
+                self.registry_timer = self.scheduler.schedule_periodic(
+                    self.config['registry_resync'], self._resync_registry)
+
+    def _ingest(self, data):
+        """Queues notification data for worker pool
+        or processes it if worker pool is not used"""
+        if self.ingestion is not None:
+            self.ingestion.put(data)
+        else:
+            self._process_events(data)
 
     def _start_authenticate(self):
         """Starts authenticating"""
@@ -160,35 +727,53 @@ class Service(event_emitter.EventEmitter):
         except Exception as ex:
             print('Failed to authenticate user: ', ex)
         finally:
-            self.authenticate_timer = threading.Timer(
-                0.9 * self.token_validation, self._start_authenticate)
             if self.authentication_event.is_set():
-                self.authenticate_timer.start()
+                self.authenticate_timer = self.scheduler.schedule_periodic(
+                    0.9 * self.token_validation, self._start_authenticate)
 
     def create_server(self):
-        """Creates socket listener."""
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind(('', 5725))
-        self.sock.listen(10)
-        self.sock.settimeout(10)
+        """Creates notification listener bound to configured
+        listen host and port. Listener is run by server thread."""
+        self.httpd = NotificationServer(
+            (self.config['listen_host'], self.config['port']), self,
+            self.config['reuse_port'])
+        self.server = threading.Thread(target=self.httpd.serve_forever)
+        self.server.daemon = True
         self.server_run = True
-        while self.server_run:
-            (conn, _) = self.sock.accept()
-            data = conn.recv(1024)
-            if not data:
-                break
-            (_, json_data) = data.split("\r\n\r\n")
-            if json_data:
-                parsed_json = json.loads(json_data)
-            reply = 'OK...' + data
-
-            conn.sendall(reply)
-            conn.close()
-            if parsed_json:
-                process_events_thread = threading.Thread(
-                    target=self._process_events, args=(parsed_json,))
-                process_events_thread.start()
-        self.sock.close()
+
+    def create_async_listener(self):
+        """Creates notification listener in service's asyncore socket map.
+        Listener is run by application's event loop, for example
+        asyncore.loop(timeout=0.1, map=service.socket_map).
+        Every loop pass hands at most drain_limit received batches
+        to service."""
+        AsyncNotificationListener(
+            (self.config['listen_host'], self.config['port']),
+            self, self.socket_map, self.config['reuse_port'])
+        self.server_run = True
+
+    def _start_receivers(self):
+        """Starts receiver processes which share notification listener port
+        and waits until all of them are listening"""
+        self.server_run = True
+        for _ in range(self.config['receivers']):
+            ready = multiprocessing.Event()
+            receiver = multiprocessing.Process(
+                target=run_receiver, args=(dict(self.config), ready))
+            receiver.daemon = True
+            receiver.start()
+            self.receivers.append(receiver)
+            if not ready.wait(10):
+                raise RuntimeError('Notification receiver did not start')
+
+    def receive_notification(self, data):
+        """Handles notification data pushed to notification listener.
+
+        Parameters:
+        data (object): Notification data
+        """
+        self.last_push = monotonic()
+        self._ingest(data)
 
     def authenticate(self):
         """Sends request to authenticate user.
@@ -212,17 +797,26 @@ class Service(event_emitter.EventEmitter):
             raise ex
 
     def shut_down_server(self):
-        """Shuts down socket listener"""
+        """Shuts down notification listener and receiver processes"""
         self.server_run = False
-        conn = httplib.HTTPConnection("localhost", self.config['port'])
-        conn.request("PUT", "/notification", '')
-        self.delete_notification_callback()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+        for receiver in self.receivers:
+            receiver.terminate()
+            receiver.join()
+        self.receivers = []
+        asyncore.close_all(self.socket_map)
+        if self.config['register_callback']:
+            self.delete_notification_callback()
 
     def register_notification_callback(self):
         """Sends request to register notification callback."""
         try:
             data = {
-                'url': 'http://localhost:5725/notification',
+                'url': 'http://%s:%d/notification' % (
+                    self.config['callback_host'], self.config['port']),
                 'headers': {}
             }
             content_type = 'application/json'
@@ -246,6 +840,256 @@ class Service(event_emitter.EventEmitter):
         except Exception as ex:
             raise ex
 
+    def add_device(self, device):
+        """Adds device to routing table, so it receives
+        register, update and deregister events of it's endpoint.
+
+        Parameters:
+        device (object): Device object
+        """
+        self.devices.setdefault(device.name, []).append(device)
+
+    def remove_device(self, device):
+        """Removes device from routing table.
+
+        Parameters:
+        device (object): Device object
+        """
+        devices = self.devices.get(device.name, [])
+        if device in devices:
+            devices.remove(device)
+        if not devices:
+            self.devices.pop(device.name, None)
+
+    def _emit_device(self, name, event):
+        """Emits event on devices of given endpoint"""
+        for device in tuple(self.devices.get(name, ())):
+            device.emit(event)
+
+    def _emit_endpoint_event(self, event, name):
+        """Emits register, update or deregister event
+        on service and devices of given endpoint"""
+        if event == 'update':
+            self.emit(event, name=name)
+        else:
+            self.emit(event, name)
+        self._emit_device(name, event)
+
+    def _emit_async_response(self, response):
+        """Emits async response event and calls it's callback"""
+        self.emit('async-response', response=response)
+        self._route_async_response(response)
+
+    def _dispatch(self, name, handler, *args):
+        """Runs event handler on dispatch lane of endpoint, so events
+        of one endpoint are handled in order and events of different
+        endpoints are handled concurrently. Runs handler in place
+        if dispatch lanes are not used.
+
+        Parameters:
+        name (str): Endpoint name
+        handler (function): Event handler
+        args (list): Event handler arguments
+        """
+        lanes = self.lanes
+        if not lanes:
+            self._run_handler(handler, *args)
+            return
+        lanes[hash(name) % len(lanes)].put(
+            functools.partial(self._run_handler, handler, *args))
+
+    def _run_handler(self, handler, *args):
+        """Runs event handler and marks thread as dispatch thread
+        while it runs, so transactions started by handler are held
+        instead of waiting for in-flight slot"""
+        active = getattr(self.dispatch_state, 'active', False)
+        self.dispatch_state.active = True
+        try:
+            handler(*args)
+        finally:
+            self.dispatch_state.active = active
+
+    def add_async_route(self, async_id, device, kind, callback):
+        """Adds async response id to routing table. Transactions expire
+        after configured transaction timeout and their callbacks are called
+        with timeout status.
+
+        Parameters:
+        async_id (str): async response id
+        device (object): Device which sent the request
+        kind (str): 'transaction' or 'observation'
+        callback (function): Callback which will be called when async response is received
+        """
+        ttl = None
+        if kind == 'transaction':
+            ttl = self.config['transaction_timeout']
+        self.routes.add(async_id, (device, kind, callback, None), ttl)
+
+    def add_observation_route(self, async_id, device, callback, conflate=None):
+        """Adds async response id of observation to routing table.
+
+        Parameters:
+        async_id (str): async response id
+        device (object): Device which sent the request
+        callback (function): Callback which will be called when notification is received
+        conflate (object): True to deliver only latest notification of a batch,
+        number of seconds to deliver only latest notification of a time window (optional)
+        """
+        self.routes.add(async_id, (device, 'observation', callback, conflate))
+
+    def resubscribe_device(self, device):
+        """Queues re-issuing of device's observations.
+        Observations of all devices are re-issued one device at a time
+        by single background thread, so subscription requests are paced
+        by request limits. Device which is already queued is not queued again.
+
+        Parameters:
+        device (object): Device which registered again
+        """
+        with self.resubscribe_lock:
+            if device.name in self.resubscribing:
+                return
+            self.resubscribing.add(device.name)
+            if self.resubscriber is None:
+                self.resubscriber = IngestionQueue(
+                    self._resubscribe, 1, 0)
+                self.resubscriber.start()
+            self.resubscriber.put(device)
+
+    def _resubscribe(self, device):
+        """Re-issues observations of device queued for resubscription"""
+        with self.resubscribe_lock:
+            self.resubscribing.discard(device.name)
+        device.resubscribe()
+
+    def _expire_transactions(self):
+        """Dispatches timeout of transactions which timed out
+        on dispatch lanes of their devices"""
+        try:
+            for (async_id, route) in self.routes.expire():
+                (device, _, callback, _) = route
+                self._dispatch(device.name, self._time_out_transaction,
+                               device, async_id, callback)
+        except Exception as ex:
+            print('Failed to expire transactions: ', ex)
+        finally:
+            if self.expiry_event.is_set():
+                self.expiry_timer = self.scheduler.schedule_periodic(
+                    self.config['expiry_interval'], self._expire_transactions)
+
+    def _flush_reorder(self):
+        """Delivers async responses held in reorder buffer
+        for lateness seconds"""
+        reorder = self.reorder
+        if reorder is None:
+            return
+        try:
+            self._deliver({}, self._conflate(reorder.flush()))
+        except Exception as ex:
+            print('Failed to flush reorder buffer: ', ex)
+        finally:
+            if self.reorder is reorder:
+                self.reorder_timer = self.scheduler.schedule_periodic(
+                    self.config['reorder_interval'], self._flush_reorder)
+
+    def _conflate(self, responses):
+        """Drops all but latest notification of conflated observations
+
+        Parameters:
+        responses (list): Async responses sorted by timestamp
+
+        Returns:
+        list: Async responses which should be delivered
+        """
+        latest = {}
+        for (index, response) in enumerate(responses):
+            route = self.routes.get(response.get('id'))
+            if route is not None and route[3]:
+                latest[response.get('id')] = index
+        if not latest:
+            return responses
+        kept = [response for (index, response) in enumerate(responses)
+                if latest.get(response.get('id'), index) == index]
+        with self.metrics_lock:
+            self.metrics['conflated'] += len(responses) - len(kept)
+        return kept
+
+    def _time_out_transaction(self, device, async_id, callback):
+        """Releases slot of expired transaction and calls it's callback
+        with timeout status"""
+        device.transactions.pop(async_id, None)
+        self.release_slot(device.name)
+        if callback is not None:
+            callback(TIMEOUT_STATUS, None)
+
+    def _hold_notification(self, response, window):
+        """Holds notification until conflation window ends.
+        Notification which arrives during the window replaces held one.
+        """
+        async_id = response.get('id')
+        with self.metrics_lock:
+            replaced = async_id in self.held_notifications
+            self.held_notifications[async_id] = response
+            if replaced:
+                self.metrics['conflated'] += 1
+                return
+        self.scheduler.schedule(window, self._release_notification, async_id)
+
+    def _release_notification(self, async_id):
+        """Delivers notification held for conflation window
+        on dispatch lane of it's device"""
+        with self.metrics_lock:
+            response = self.held_notifications.pop(async_id, None)
+        route = self.routes.get(async_id)
+        if response is not None and route is not None and route[2]:
+            self._dispatch(route[0].name, route[2],
+                           response.get('status'), response.get('payload'))
+
+    def _route_async_response(self, response):
+        """Calls callback of async response's transaction or observation"""
+        async_id = response.get('id')
+        route = self.routes.get(async_id)
+        if route is None:
+            return
+        (device, kind, callback, conflate) = route
+        if conflate and conflate is not True:
+            self._hold_notification(response, conflate)
+            return
+        if kind == 'transaction':
+            if self.routes.pop(async_id, None) is None:
+                return
+            device.transactions.pop(async_id, None)
+            self.release_slot(device.name)
+        if callback is not None:
+            callback(response.get('status'), response.get('payload'))
+
+    def on_batch(self, listener):
+        """Adds listener which receives whole notification batch in one call.
+        Batch is grouped by kind ('register', 'update', 'deregister',
+        'async-response') and by endpoint name. Async responses
+        which are not routed to any device are grouped under None.
+
+        Parameters:
+        listener (function): Function which is called with grouped batch
+        """
+        self.on('batch', listener)
+
+    def _group_batch(self, data):
+        """Groups notification data by kind and endpoint name"""
+        batch = {}
+        for (kind, section) in [('register', 'registrations'),
+                                ('update', 'reg-updates'),
+                                ('deregister', 'de-registrations')]:
+            group = batch[kind] = {}
+            for i in data.get(section, []):
+                group.setdefault(i['name'], []).append(i)
+        group = batch['async-response'] = {}
+        for resp in data['async-responses']:
+            route = self.routes.get(resp.get('id'))
+            name = None if route is None else route[0].name
+            group.setdefault(name, []).append(resp)
+        return batch
+
     def _process_events(self, data):
         """Handles notification data and emits events.
 
@@ -253,25 +1097,127 @@ class Service(event_emitter.EventEmitter):
         data (object): Events - Notifications (registrations,
         reg-updates, de-registrations, async-responses)
         """
-        for i in data['registrations']:
-            self.emit('register', i['name'])
+        reorder = self.reorder
+        responses = self._deduplicate(data['async-responses'])
+        if reorder is not None:
+            responses = reorder.push(responses)
+        else:
+            responses = sorted(responses, key=lambda k: k['timestamp'])
+        self._deliver(data, self._conflate(responses))
+
+    def _deduplicate(self, responses):
+        """Drops async responses which were already delivered"""
+        dedup = self.dedup
+        if dedup is None:
+            return responses
+        unique = dedup.unique(
+            responses, lambda i: (i.get('id'), i.get('timestamp')))
+        if len(unique) != len(responses):
+            with self.metrics_lock:
+                self.metrics['duplicates'] += len(responses) - len(unique)
+        return unique
+
+    def _deliver(self, data, responses):
+        """Emits batch of delivered notifications and dispatches each one.
 
-        for i in data['reg-updates']:
-            self.emit('update', name=i['name'])
+        Parameters:
+        data (object): Endpoint notifications of the batch
+        responses (list): Async responses to deliver in order
+        """
+        if self.count('batch'):
+            batch = dict(data)
+            batch['async-responses'] = responses
+            self._run_handler(self.emit, 'batch', self._group_batch(batch))
+
+        for section in ['registrations', 'reg-updates', 'de-registrations']:
+            for i in data.get(section, []):
+                self._process_item(section, i)
+        for resp in responses:
+            self._process_item('async-responses', resp)
+
+    def _process_item(self, section, item):
+        """Dispatches single notification of given section"""
+        if section == 'async-responses':
+            route = self.routes.get(item.get('id'))
+            name = item.get('id') if route is None else route[0].name
+            self._dispatch(name, self._emit_async_response, item)
+        elif section in ENDPOINT_EVENTS:
+            self._dispatch(item['name'], self._emit_endpoint_event,
+                           ENDPOINT_EVENTS[section], item['name'])
+
+    def _send(self, verb, request_data):
+        """Sends request through circuit breaker and retries it according
+        to verb's retry policy with exponential jittered backoff.
+        Requests are bounded by configured connect and read timeouts.
+        POST is not idempotent, so it is only retried when server
+        did not process the request (connect timeout or 503).
 
-        for i in data['de-registrations']:
-            self.emit('deregister', i['name'])
+        Parameters:
+        verb (str): HTTP method name
+        request_data (object): Request arguments
 
-        responses = sorted(data['async-responses'],
-                           key=lambda k: k['timestamp'])
-        for resp in responses:
-            self.emit('async-response', response=resp)
+        Returns:
+        object: Object with data and response objects
+        """
+        request_data['timeout'] = (self.config['connect_timeout'],
+                                   self.config['read_timeout'])
+        if self.config['compression']:
+            self._compress(request_data)
+        retries = self.config['retries'].get(verb, 0)
+        attempt = 0
+        while True:
+            if self.breaker is not None and not self.breaker.allow():
+                raise CircuitOpenError('Circuit breaker is open')
+            try:
+                response = getattr(requests, verb)(**request_data)
+            except requests.RequestException as ex:
+                if self.breaker is not None:
+                    self.breaker.failure()
+                retry = (verb != 'post' or
+                         isinstance(ex, requests.ConnectTimeout))
+                if attempt >= retries or not retry:
+                    raise ex
+            else:
+                if response.status_code < 500:
+                    if self.breaker is not None:
+                        self.breaker.success()
+                    return response
+                if self.breaker is not None:
+                    self.breaker.failure()
+                retry = response.status_code == 503 or (
+                    verb != 'post' and response.status_code in (502, 504))
+                if attempt >= retries or not retry:
+                    return response
+            delay = min(self.config['retry_max_backoff'],
+                        self.config['retry_backoff'] * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
+            attempt += 1
+
+    def _compress(self, request_data):
+        """Asks for compressed response and gzips request body
+        which is at least compression threshold bytes long.
 
-    def get(self, path):
+        Parameters:
+        request_data (object): Request arguments
+        """
+        headers = request_data['headers']
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        if 'json' in request_data:
+            request_data['data'] = json.dumps(request_data.pop('json'))
+        body = request_data.get('data')
+        if body is None or len(body) < self.config['compression_threshold']:
+            return
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        request_data['data'] = compressor.compress(bytes(body)) + \
+            compressor.flush()
+        headers['Content-Encoding'] = 'gzip'
+
+    def get(self, path, stream=False):
         """Performs GET requests with given path.
 
         Parameters:
         path (str): Request path
+        stream (bool): Whether response body is read incrementally (optional)
 
         Returns:
         object: Object with data and response objects
@@ -288,11 +1234,9 @@ class Service(event_emitter.EventEmitter):
 
         if self.config['ca'] != '':
             request_data['verify'] = self.config['ca']
-        try:
-            req = requests.get(**request_data)
-            return req
-        except requests.ConnectionError as ex:
-            raise ex
+        if stream:
+            request_data['stream'] = True
+        return self._send('get', request_data)
 
     def put(
             self,
@@ -328,11 +1272,7 @@ class Service(event_emitter.EventEmitter):
 
         if self.config['ca'] != '':
             request_data['verify'] = self.config['ca']
-        try:
-            req = requests.put(**request_data)
-            return req
-        except requests.ConnectionError as ex:
-            raise ex
+        return self._send('put', request_data)
 
     def post(
             self,
@@ -368,11 +1308,7 @@ class Service(event_emitter.EventEmitter):
 
         if self.config['ca'] != '':
             request_data['verify'] = self.config['ca']
-        try:
-            req = requests.post(**request_data)
-            return req
-        except requests.ConnectionError as ex:
-            raise ex
+        return self._send('post', request_data)
 
     def delete(self, path):
         """Performs DELETE requests with given path.
@@ -395,11 +1331,7 @@ class Service(event_emitter.EventEmitter):
 
         if self.config['ca'] != '':
             request_data['verify'] = self.config['ca']
-        try:
-            req = requests.delete(**request_data)
-            return req
-        except requests.ConnectionError as ex:
-            raise ex
+        return self._send('delete', request_data)
 
 
 class Device(event_emitter.EventEmitter):
@@ -407,9 +1339,10 @@ class Device(event_emitter.EventEmitter):
 
     def __init__(self, service, name):
         """Constructor initiliazes given service object, device's id
-        and starts listening for events emited by service (when device
-        registers, updates, deregisters, sends data), handles "async
-        responses" and emits "register", "update", "deregister" events.
+        and adds device to service's routing table, so it receives
+        events of it's endpoint (when device registers, updates,
+        deregisters) and emits "register", "update", "deregister" events.
+        Async responses are routed by service to request callbacks.
 
         Parameters:
         service (object): Service object
@@ -421,32 +1354,13 @@ class Device(event_emitter.EventEmitter):
         self.name = name
         self.transactions = {}
         self.observations = {}
+        self.reads = {}
+        self.subscriptions = {}
+        self.pending_subscriptions = {}
+        self.lock = threading.Lock()
+        self.on('register', self._on_register)
 
-        def register(name):
-            if self.name == name:
-                self.emit('register')
-        self.service.on('register', register)
-
-        def update(name):
-            if self.name == name:
-                self.emit('update')
-        self.service.on('update', update)
-
-        def deregister(name):
-            if self.name == name:
-                self.emit('deregister')
-        self.service.on('deregister', deregister)
-
-        def async_response_handle(response):
-            async_response_id = response.get('id')
-            code = response.get('status')
-            data = response.get('payload')
-            if not self.transactions.get(async_response_id) is None:
-                self.transactions[async_response_id](code, data)
-                del self.transactions[async_response_id]
-            if not self.observations.get(async_response_id) is None:
-                self.observations[async_response_id](code, data)
-        self.service.on('async-response', async_response_handle)
+        self.service.add_device(self)
 
     def add_async_callback(self, async_id, callback):
         """Adds a callback to transactions list. Key value is device's id.
@@ -456,6 +1370,36 @@ class Device(event_emitter.EventEmitter):
         callback (function): Callback which will be called when async response is received
         """
         self.transactions[async_id] = callback
+        self.service.add_async_route(async_id, self, 'transaction', callback)
+
+    def _transaction(self, send, path, callback, *args):
+        """Sends request which starts transaction and stores it's callback.
+        Waits for in-flight slot if service limits requests. Request made
+        by event handler is held until slot is free instead.
+
+        Parameters:
+        send (function): Service request method
+        path (str): Resource path
+        callback (function): Callback which will be called when async response is received
+        args (list): Additional request arguments (optional)
+
+        Returns:
+        str: async response id or None if request is held
+        """
+        def request():
+            try:
+                response = send('/endpoints/' + self.name + path, *args)
+                if response.status_code == 202:
+                    data = response.json()
+                    async_id = data['async-response-id']
+                    self.add_async_callback(async_id, callback)
+                    return async_id
+                else:
+                    raise requests.HTTPError(response.status_code)
+            except Exception as ex:
+                self.service.release_slot(self.name)
+                raise ex
+        return self.service.submit_transaction(self.name, request, callback)
 
     def get_objects(self):
         """Sends request to get all device's objects.
@@ -464,12 +1408,8 @@ class Device(event_emitter.EventEmitter):
         object: Dictonary with device's objects
         """
         try:
-            response = self.service.get('/endpoints/' + self.name)
-            if response.status_code == 202:
-                data = response.json()
-                return data
-            else:
-                raise requests.HTTPError(response.status_code)
+            return self.service.get_json(
+                '/endpoints/' + self.name, 202, 'objects')
         except Exception as ex:
             raise ex
 
@@ -480,20 +1420,63 @@ class Device(event_emitter.EventEmitter):
         path (str): Resource path
         callback (function): Callback which will be called when async response is received
 
+        Returns:
+        str: async response id or None if request is held
+        """
+        if not self.service.config['coalesce_reads']:
+            return self._transaction(self.service.get, path, callback)
+        return self._coalesced_read(path, callback)
+
+    def _coalesced_read(self, path, callback):
+        """Sends read request unless read of the same path is in flight.
+        Callers which join in-flight read get it's async response id
+        and their callbacks are called with the same response.
+
+        Parameters:
+        path (str): Resource path
+        callback (function): Callback which will be called when async response is received
+
         Returns:
         str: async response id
         """
-        try:
-            response = self.service.get('/endpoints/' + self.name + path)
-            if response.status_code == 202:
-                data = response.json()
-                async_id = data['async-response-id']
-                self.add_async_callback(async_id, callback)
-                return async_id
+        leader = False
+        with self.lock:
+            flight = self.reads.get(path)
+            if flight is not None:
+                flight['callbacks'].append(callback)
             else:
-                raise requests.HTTPError(response.status_code)
+                flight = {
+                    'id': None,
+                    'error': None,
+                    'callbacks': [callback],
+                    'ready': threading.Event()
+                }
+                self.reads[path] = flight
+                leader = True
+        if not leader:
+            flight['ready'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['id']
+
+        def complete(code, data):
+            with self.lock:
+                if self.reads.get(path) is flight:
+                    del self.reads[path]
+            for read_callback in flight['callbacks']:
+                if read_callback is not None:
+                    read_callback(code, data)
+        try:
+            flight['id'] = self._transaction(self.service.get, path, complete)
+            return flight['id']
         except Exception as ex:
+            flight['error'] = ex
+            with self.lock:
+                if self.reads.get(path) is flight:
+                    del self.reads[path]
             raise ex
+        finally:
+            flight['ready'].set()
 
     def write(self, path, callback=None, payload=None,
               content_type='application/vnd.oma.lwm2m+tlv'):
@@ -506,20 +1489,10 @@ class Device(event_emitter.EventEmitter):
         content_type (str): Content type (optional)
 
         Returns:
-        str: async response id
+        str: async response id or None if request is held
         """
-        try:
-            response = self.service.put(
-                '/endpoints/' + self.name + path, payload, content_type)
-            if response.status_code == 202:
-                data = response.json()
-                async_id = data['async-response-id']
-                self.add_async_callback(async_id, callback)
-                return async_id
-            else:
-                raise requests.HTTPError(response.status_code)
-        except Exception as ex:
-            raise ex
+        return self._transaction(
+            self.service.put, path, callback, payload, content_type)
 
     def execute(
             self,
@@ -535,54 +1508,211 @@ class Device(event_emitter.EventEmitter):
         payload (bytearray):  Data (optional)
         content_type (str): Content type (optional)
 
+        Returns:
+        str: async response id or None if request is held
+        """
+        return self._transaction(
+            self.service.post, path, callback, payload, content_type)
+
+    def observe(self, path, callback=None, conflate=None):
+        """Sends request to subscribe to resource.
+        Subscription is stored by path and shared: if resource is already
+        observed, callback is added to existing subscription and
+        every notification is delivered to all of it's callbacks.
+        Conflated subscription delivers only the latest notification
+        of each pulled batch or of each time window, so all callbacks
+        of the path must use the same conflation.
+        Callers which observe the path while subscription request is in
+        flight wait for it and join the subscription.
+
+        Parameters:
+        path (str): Resource path
+        callback (function): Callback which will be called when async response is received
+        conflate (object): True to conflate notifications within a batch,
+        number of seconds to conflate them within a time window (optional)
+
         Returns:
         str: async response id
+
+        Raises:
+        ValueError: If path is observed with different conflation
         """
-        try:
-            response = self.service.post(
-                '/endpoints/' + self.name + path, payload, content_type)
-            if response.status_code == 202:
-                data = response.json()
-                async_id = data['async-response-id']
-                self.add_async_callback(async_id, callback)
-                return async_id
+        leader = False
+        with self.lock:
+            subscription = self.subscriptions.get(path)
+            flight = self.pending_subscriptions.get(path)
+            current = subscription if subscription is not None else flight
+            if (current is not None and
+                    (current['conflate'] or None) != (conflate or None)):
+                raise ValueError('%s is observed with conflation %r' %
+                                 (path, current['conflate']))
+            if subscription is not None:
+                subscription['callbacks'].append(callback)
+                return subscription['id']
+            if flight is not None:
+                flight['callbacks'].append(callback)
             else:
-                raise requests.HTTPError(response.status_code)
+                flight = {
+                    'id': None,
+                    'error': None,
+                    'callbacks': [callback],
+                    'conflate': conflate,
+                    'ready': threading.Event()
+                }
+                self.pending_subscriptions[path] = flight
+                leader = True
+        if not leader:
+            flight['ready'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['id']
+        try:
+            flight['id'] = self._subscribe(path, flight['callbacks'], conflate)
+            return flight['id']
         except Exception as ex:
+            flight['error'] = ex
             raise ex
+        finally:
+            with self.lock:
+                if self.pending_subscriptions.get(path) is flight:
+                    del self.pending_subscriptions[path]
+            flight['ready'].set()
 
-    def observe(self, path, callback=None):
-        """Sends request to subscribe to resource.
+    def _subscribe(self, path, callbacks, conflate=None, renewed=None):
+        """Sends subscription request and stores path's subscription.
+        Callbacks and conflation of previous subscription of the path are kept.
+        Renewed subscription is not stored if it was cancelled meanwhile.
 
         Parameters:
         path (str): Resource path
-        callback (function): Callback which will be called when async response is received
+        callbacks (list): Callbacks which are added to subscription
+        conflate (object): Conflation of notifications (optional)
+        renewed (dict): Subscription which is re-issued (optional)
 
         Returns:
-        str: async response id
+        str: async response id or None if renewed subscription was cancelled
         """
         try:
+            self.service.acquire_slot(self.name, False)
             response = self.service.put('/subscriptions/' + self.name + path)
             if response.status_code == 202:
                 data = response.json()
                 async_id = data['async-response-id']
-                self.observations[async_id] = callback
+                with self.lock:
+                    cancelled = (renewed is not None and
+                                 self.subscriptions.get(path) is not renewed)
+                    if not cancelled:
+                        notify = self._store_subscription(
+                            path, async_id, callbacks, conflate)
+                if cancelled:
+                    self._discard_renewal(path)
+                    return None
+                self.service.add_observation_route(
+                    async_id, self, notify, conflate)
                 return async_id
             else:
                 raise requests.HTTPError(response.status_code)
         except Exception as ex:
             raise ex
 
-    def cancel_observe(self, path):
-        """Sends request to cancel subscriptions.
+    def _store_subscription(self, path, async_id, callbacks, conflate):
+        """Stores path's subscription replacing previous one.
+        Called with device lock held.
 
         Parameters:
         path (str): Resource path
+        async_id (str): async response id of subscription
+        callbacks (list): Callbacks which are added to subscription
+        conflate (object): Conflation of notifications
 
         Returns:
-        int: HTTP status code
+        function: Function which notifies subscription callbacks
+        """
+        previous = self._drop_subscription(path)
+        callbacks = list(callbacks)
+        if previous is not None:
+            callbacks = previous['callbacks'] + callbacks
+            if conflate is None:
+                conflate = previous['conflate']
+        subscription = {
+            'id': async_id,
+            'callbacks': callbacks,
+            'conflate': conflate
+        }
+
+        def notify(code, data):
+            for callback in list(subscription['callbacks']):
+                if callback is not None:
+                    callback(code, data)
+        self.subscriptions[path] = subscription
+        self.observations[async_id] = notify
+        return notify
+
+    def _discard_renewal(self, path):
+        """Cancels subscription which was re-issued while path's
+        observation was cancelled, unless path was observed again"""
+        with self.lock:
+            if path in self.subscriptions or path in self.pending_subscriptions:
+                return
+        try:
+            self.service.delete('/subscriptions/' + self.name + path)
+        except Exception as ex:
+            print('Failed to cancel resubscription: ', ex)
+
+    def _drop_subscription(self, path):
+        """Removes subscription of path and it's async response route"""
+        subscription = self.subscriptions.pop(path, None)
+        if subscription is not None:
+            self.observations.pop(subscription['id'], None)
+            self.service.routes.pop(subscription['id'])
+        return subscription
+
+    def resubscribe(self):
+        """Re-issues all device's observations keeping their callbacks.
+        Called in background when device registers again
+        if resubscribe is enabled in service configuration.
+        Observation which is cancelled meanwhile is not re-issued.
+        """
+        for path in list(self.subscriptions):
+            with self.lock:
+                subscription = self.subscriptions.get(path)
+            if subscription is None:
+                continue
+            try:
+                self._subscribe(path, [], renewed=subscription)
+            except Exception as ex:
+                print('Failed to resubscribe: ', ex)
+
+    def _on_register(self):
+        """Queues re-issuing of observations after device registers"""
+        if self.service.config['resubscribe'] and self.subscriptions:
+            self.service.resubscribe_device(self)
+
+    def cancel_observe(self, path, callback=None):
+        """Removes callback from resource subscription. Sends request to
+        cancel subscription when last callback is removed
+        or callback is not given.
+        Subscription is removed before the request is sent, so observer
+        which arrives meanwhile starts a new subscription.
+
+        Parameters:
+        path (str): Resource path
+        callback (function): Callback which was given to observe (optional)
+
+        Returns:
+        int: HTTP status code or None if subscription has other callbacks
         """
+        with self.lock:
+            subscription = self.subscriptions.get(path)
+            if subscription is not None and callback is not None:
+                if callback not in subscription['callbacks']:
+                    return None
+                subscription['callbacks'].remove(callback)
+                if subscription['callbacks']:
+                    return None
+            self._drop_subscription(path)
         try:
+            self.service.acquire_slot(self.name, False)
             response = self.service.delete(
                 '/subscriptions/' + self.name + path)
             return response.status_code
@@ -0,0 +1,189 @@
+"""This module stores monotonic clock and job scheduler"""
+import ctypes
+import heapq
+import itertools
+import sys
+import threading
+import time
+
+CLOCK_MONOTONIC = 1
+
+
+class Timespec(ctypes.Structure):
+    """This class represents timespec structure of clock_gettime."""
+    # pylint: disable=too-few-public-methods
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def load_clock():
+    """Finds monotonic clock. Python 2 has no monotonic clock,
+    so clock_gettime(CLOCK_MONOTONIC) is called through ctypes on Linux.
+    Wall clock is used if neither is available.
+
+    Returns:
+    function: Function which returns time in seconds
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if not sys.platform.startswith('linux'):
+        return time.time
+    clock_gettime = None
+    for library in ['libc.so.6', 'librt.so.1']:
+        try:
+            clock_gettime = ctypes.CDLL(library, use_errno=True).clock_gettime
+            break
+        except (OSError, AttributeError):
+            pass
+    if clock_gettime is None:
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+
+    def clock():
+        """Returns time of CLOCK_MONOTONIC"""
+        spec = Timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec)) != 0:
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+    return clock
+
+
+CLOCK = load_clock()
+
+
+def monotonic():
+    """Returns time of monotonic clock, which is not affected
+    by wall clock changes.
+
+    Returns:
+    float: Time in seconds
+    """
+    return CLOCK()
+
+
+class ScheduledJob(object):
+    """This class represents job scheduled by Scheduler.
+
+    Parameters:
+    function (function): Function which is called
+    args (tuple): Function arguments
+    """
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.deadline = None
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancels job if it has not run yet."""
+        self.cancelled = True
+
+    def run(self):
+        """Calls function unless job was cancelled."""
+        if not self.cancelled:
+            self.function(*self.args)
+
+
+class Scheduler(object):
+    """This class represents single thread which runs scheduled jobs
+    in deadline order. Thread is started when first job is scheduled.
+    Periodic job rescheduled by itself is scheduled relative to its
+    deadline, so it does not drift.
+    """
+
+    def __init__(self):
+        self.jobs = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.current = None
+
+    def schedule(self, delay, function, *args):
+        """Schedules function call.
+
+        Parameters:
+        delay (float): Seconds before function is called
+        function (function): Function which is called
+        args (list): Function arguments
+
+        Returns:
+        object: Scheduled job
+        """
+        return self._schedule(False, delay, function, args)
+
+    def schedule_periodic(self, delay, function, *args):
+        """Schedules next run of periodic job. When called from running
+        job, delay is counted from deadline of running job instead of
+        current time.
+
+        Parameters:
+        delay (float): Seconds between runs
+        function (function): Function which is called
+        args (list): Function arguments
+
+        Returns:
+        object: Scheduled job
+        """
+        return self._schedule(True, delay, function, args)
+
+    def _schedule(self, periodic, delay, function, args):
+        """Pushes job into deadline heap and starts scheduler thread"""
+        job = ScheduledJob(function, args)
+        with self.condition:
+            now = monotonic()
+            base = now
+            if (periodic and self.current is not None and
+                    threading.current_thread() is self.thread):
+                base = self.current.deadline
+            job.deadline = max(now, base + delay)
+            heapq.heappush(self.jobs, (job.deadline, next(self.sequence), job))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+        return job
+
+    def stop(self):
+        """Cancels all scheduled jobs and stops scheduler thread
+        after job which is currently running."""
+        with self.condition:
+            for (_, _, job) in self.jobs:
+                job.cancel()
+            self.jobs = []
+            self.thread = None
+            self.condition.notify_all()
+
+    def join(self, timeout=None):
+        """Waits until scheduler thread stops.
+
+        Parameters:
+        timeout (float): Seconds to wait (optional)
+        """
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _run(self):
+        """Runs jobs until scheduler is stopped"""
+        thread = threading.current_thread()
+        while True:
+            with self.condition:
+                while self.thread is thread:
+                    timeout = None
+                    if self.jobs:
+                        timeout = self.jobs[0][0] - monotonic()
+                        if timeout <= 0:
+                            break
+                    self.condition.wait(timeout)
+                if self.thread is not thread:
+                    return
+                (_, _, job) = heapq.heappop(self.jobs)
+                self.current = job
+            try:
+                job.run()
+            except Exception as ex:
+                print('Failed to run scheduled job: ', ex)
+            with self.condition:
+                if self.thread is thread:
+                    self.current = None
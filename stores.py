@@ -0,0 +1,220 @@
+"""This module stores response cache, endpoint registry
+and async response routing table"""
+import heapq
+import threading
+from scheduling import monotonic
+
+
+class ResponseCache(object):
+    """This class represents cache of parsed responses with per-entry TTL.
+    Every invalidation increases generation, so responses fetched before
+    invalidation are not stored.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Looks up unexpired entry.
+
+        Parameters:
+        key (str): Request path
+
+        Returns:
+        tuple: Whether entry was found and cached value
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > monotonic():
+            return True, entry[1]
+        return False, None
+
+    def set(self, key, value, ttl, generation):
+        """Stores entry if cache was not invalidated since generation.
+
+        Parameters:
+        key (str): Request path
+        value (object): Parsed response
+        ttl (float): Seconds until entry expires
+        generation (int): Generation when request was sent
+        """
+        with self.lock:
+            if generation == self.generation and ttl > 0:
+                self.entries[key] = (monotonic() + ttl, value)
+
+    def invalidate(self, *keys):
+        """Removes entries.
+
+        Parameters:
+        keys (list): Request paths
+        """
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        """Removes all entries."""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+class EndpointRegistry(object):
+    """This class represents local registry of registered endpoints.
+    Registry is seeded from full endpoint list and then updated
+    incrementally from registration notifications. Notifications which
+    arrive during resynchronization are replayed over fetched list.
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self.journal = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def __contains__(self, name):
+        return name in self.endpoints
+
+    def __iter__(self):
+        return iter(list(self.endpoints.values()))
+
+    def get(self, name):
+        """Looks up endpoint.
+
+        Parameters:
+        name (str): Endpoint name
+
+        Returns:
+        object: Endpoint data or None if endpoint is not registered
+        """
+        return self.endpoints.get(name)
+
+    def add(self, name):
+        """Adds endpoint on registration or registration update.
+
+        Parameters:
+        name (str): Endpoint name
+        """
+        with self.lock:
+            if name not in self.endpoints:
+                self.endpoints[name] = {'name': name}
+            if self.journal is not None:
+                self.journal.append((True, name))
+
+    def remove(self, name):
+        """Removes endpoint on deregistration.
+
+        Parameters:
+        name (str): Endpoint name
+        """
+        with self.lock:
+            self.endpoints.pop(name, None)
+            if self.journal is not None:
+                self.journal.append((False, name))
+
+    def begin_resync(self):
+        """Starts recording notifications until resync is finished."""
+        with self.lock:
+            self.journal = []
+
+    def finish_resync(self, endpoints):
+        """Replaces registry contents with full endpoint list and replays
+        notifications received since resync began.
+
+        Parameters:
+        endpoints (list): List of endpoints
+        """
+        with self.lock:
+            fetched = dict((i['name'], i) for i in endpoints)
+            for (registered, name) in self.journal or []:
+                if not registered:
+                    fetched.pop(name, None)
+                elif name not in fetched:
+                    fetched[name] = {'name': name}
+            self.endpoints = fetched
+            self.journal = None
+
+
+class TransactionStore(object):
+    """This class represents async response routing table with
+    per-entry deadlines. Deadlines are kept in a heap, expired entries
+    are removed lazily, so expiry costs O(log n) per entry.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.deadlines = []
+        self.expired = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        return self.entries[key][1]
+
+    def get(self, key, default=None):
+        """Looks up entry.
+
+        Parameters:
+        key (str): async response id
+        default (object): Value returned if entry does not exist (optional)
+
+        Returns:
+        object: Entry value
+        """
+        entry = self.entries.get(key)
+        return default if entry is None else entry[1]
+
+    def add(self, key, value, ttl=None):
+        """Adds entry which expires after ttl seconds.
+
+        Parameters:
+        key (str): async response id
+        value (object): Entry value
+        ttl (float): Seconds until entry expires, None never expires (optional)
+        """
+        with self.lock:
+            deadline = None if ttl is None else monotonic() + ttl
+            self.entries[key] = (deadline, value)
+            if deadline is not None:
+                heapq.heappush(self.deadlines, (deadline, key))
+
+    def pop(self, key, default=None):
+        """Removes entry.
+
+        Parameters:
+        key (str): async response id
+        default (object): Value returned if entry does not exist (optional)
+
+        Returns:
+        object: Entry value
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def expire(self):
+        """Removes entries which deadline has passed.
+
+        Returns:
+        list: Expired (key, value) pairs
+        """
+        now = monotonic()
+        expired = []
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                (deadline, key) = heapq.heappop(self.deadlines)
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] == deadline:
+                    del self.entries[key]
+                    expired.append((key, entry[1]))
+            self.expired += len(expired)
+        return expired
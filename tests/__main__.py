@@ -1,4 +1,9 @@
 from tests.punica_test import TestServiceMethods, TestDeviceMethods
+from tests.limits_test import TestRequestLimiter
+from tests.stores_test import TestTransactionStore
+from tests.ingestion_test import TestReorderBuffer, TestDuplicateFilter, \
+	TestIngestionQueue
+from tests.scheduling_test import TestScheduler
 from tests.lwm2m_tlv_test import TestEncodeResourceValue, \
 	TestDecodeResourceValue, TestEncode, TestDecode, TestEncodeResource, \
 	TestDecodeResource, TestEncodeResourceInstance, \
@@ -0,0 +1,118 @@
+"""Tests for `ingestion.py`."""
+
+import unittest
+import time
+import threading
+from ingestion import ReorderBuffer
+from ingestion import DuplicateFilter
+from ingestion import IngestionQueue
+
+
+class TestReorderBuffer(unittest.TestCase):
+    """
+    Tests for ReorderBuffer class
+    """
+
+    def test_push(self):
+        """
+        should release responses in timestamp order across batches
+        once lateness bound has passed
+        """
+        buf = ReorderBuffer(2, 10)
+        self.assertEqual(buf.push([{'timestamp': 4}, {'timestamp': 3}]), [])
+        self.assertEqual(buf.push([{'timestamp': 1}, {'timestamp': 6}]),
+                         [{'timestamp': 1}, {'timestamp': 3},
+                          {'timestamp': 4}])
+        self.assertEqual(buf.push([{'timestamp': 0}]), [{'timestamp': 0}])
+        self.assertEqual(buf.late, 1)
+        self.assertEqual(len(buf), 1)
+        self.assertEqual(buf.flush(True), [{'timestamp': 6}])
+
+    def test_overflow(self):
+        """
+        should release oldest responses when buffer is full
+        """
+        buf = ReorderBuffer(100, 2)
+        released = buf.push([{'timestamp': 3}, {'timestamp': 1},
+                             {'timestamp': 2}])
+        self.assertEqual(released, [{'timestamp': 1}])
+        self.assertEqual(buf.overflow, 1)
+        self.assertEqual(len(buf), 2)
+
+    def test_flush(self):
+        """
+        should release responses held for lateness seconds
+        """
+        buf = ReorderBuffer(0.05, 10)
+        buf.push([{'timestamp': 1.01}, {'timestamp': 1}])
+        self.assertEqual(buf.flush(), [])
+        time.sleep(0.1)
+        self.assertEqual(buf.flush(),
+                         [{'timestamp': 1}, {'timestamp': 1.01}])
+
+
+class TestDuplicateFilter(unittest.TestCase):
+    """
+    Tests for DuplicateFilter class
+    """
+
+    def test_seen(self):
+        """
+        should remember at least size recent keys
+        """
+        dedup = DuplicateFilter(2)
+        self.assertFalse(dedup.seen(1))
+        self.assertTrue(dedup.seen(1))
+        self.assertFalse(dedup.seen(2))
+        self.assertFalse(dedup.seen(3))
+        self.assertTrue(dedup.seen(2))
+        self.assertFalse(dedup.seen(4))
+        self.assertFalse(dedup.seen(1))
+
+    def test_unique(self):
+        """
+        should drop items whose key was seen, also within the same list
+        """
+        dedup = DuplicateFilter(10)
+        items = [{'id': 'a'}, {'id': 'b'}, {'id': 'a'}]
+        self.assertEqual(dedup.unique(items, lambda i: i['id']),
+                         [{'id': 'a'}, {'id': 'b'}])
+        self.assertEqual(dedup.unique(items, lambda i: i['id']), [])
+
+
+class TestIngestionQueue(unittest.TestCase):
+    """
+    Tests for IngestionQueue class
+    """
+
+    def test_workers(self):
+        """
+        should process queued batches on worker threads
+        """
+        processed = []
+        done = threading.Event()
+
+        def handler(batch):
+            """Batch handler"""
+            processed.append(batch)
+            if len(processed) == 3:
+                done.set()
+        ingestion = IngestionQueue(handler, 2, 10)
+        ingestion.start()
+        for batch in range(3):
+            ingestion.put(batch)
+        self.assertTrue(done.wait(1))
+        ingestion.stop()
+        self.assertEqual(sorted(processed), [0, 1, 2])
+
+    def test_drop_oldest(self):
+        """
+        should drop the oldest batch when queue is full
+        """
+        ingestion = IngestionQueue(None, 0, 2, 'drop-oldest')
+        for batch in range(3):
+            ingestion.put(batch)
+        self.assertEqual(ingestion.dropped, 1)
+        self.assertEqual(ingestion.depth(), 2)
+        self.assertEqual(ingestion.high_watermark, 2)
+        self.assertEqual(ingestion.queue.get_nowait(), 1)
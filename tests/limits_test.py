@@ -0,0 +1,87 @@
+"""Tests for `limits.py`."""
+
+import unittest
+import time
+import threading
+from limits import RequestLimiter
+from limits import AdmissionTimeout
+
+DEVICE_NAME = 'threeSeven'
+
+
+class TestRequestLimiter(unittest.TestCase):
+    """
+    Tests for RequestLimiter class
+    """
+
+    def test_in_flight_cap(self):
+        """
+        should hold request until endpoint's in-flight slot is released
+        """
+        limiter = RequestLimiter(max_in_flight=1)
+        limiter.acquire(DEVICE_NAME)
+        admitted = threading.Event()
+
+        def request():
+            """Request which waits for slot"""
+            limiter.acquire(DEVICE_NAME)
+            admitted.set()
+        thread = threading.Thread(target=request)
+        thread.start()
+        self.assertFalse(admitted.wait(0.1))
+        limiter.release(DEVICE_NAME)
+        self.assertTrue(admitted.wait(1))
+        thread.join()
+        self.assertEqual(limiter.in_flight[DEVICE_NAME], 1)
+
+    def test_acquire_timeout(self):
+        """
+        should raise AdmissionTimeout if slot is not released in time
+        and leave the queue to later requests
+        """
+        limiter = RequestLimiter(max_in_flight=1)
+        limiter.acquire(DEVICE_NAME)
+        with self.assertRaises(AdmissionTimeout):
+            limiter.acquire(DEVICE_NAME, timeout=0.05)
+        self.assertEqual(len(limiter.waiting), 0)
+        limiter.release(DEVICE_NAME)
+        limiter.acquire(DEVICE_NAME, timeout=0.05)
+        self.assertEqual(limiter.in_flight[DEVICE_NAME], 1)
+
+    def test_fair_queue(self):
+        """
+        should serve waiting requests round-robin across endpoints
+        """
+        limiter = RequestLimiter(max_in_flight=1)
+        limiter.acquire('first')
+        limiter.acquire('second')
+        order = []
+
+        def request(name):
+            """Request which waits for slot"""
+            limiter.acquire(name)
+            order.append(name)
+        threads = []
+        for name in ['first', 'first', 'second']:
+            threads.append(threading.Thread(target=request, args=(name,)))
+            threads[-1].start()
+            time.sleep(0.05)
+        limiter.release('first')
+        limiter.release('second')
+        time.sleep(0.05)
+        self.assertEqual(sorted(order), ['first', 'second'])
+        limiter.release('first')
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order[-1], 'first')
+
+    def test_rate_limit(self):
+        """
+        should not admit more requests per second than configured rate
+        """
+        limiter = RequestLimiter(rate=20)
+        start = time.time()
+        for _ in range(3):
+            limiter.acquire(DEVICE_NAME, False)
+        self.assertTrue(time.time() - start >= 0.09)
+        self.assertFalse(limiter.in_flight)
@@ -1,16 +1,25 @@
 """Tests for `punica.py`."""
 
 import unittest
+import asyncore
 import json
+import multiprocessing
 import time
+import threading
+import socket
 import httplib
 import sys
+import zlib
 import responses
 import requests
 from rest_response import resp
 sys.path.append('../')
 from punica import Service
 from punica import Device
+from limits import CircuitOpenError
+from stores import EndpointRegistry
+from ingestion import ReorderBuffer
+from ingestion import iter_sections
 
 SERVICE = Service()
 URL = 'http://localhost:8888'
@@ -38,18 +47,218 @@ class TestServiceMethods(unittest.TestCase):
         responses.add(responses.DELETE, URL + '/notification/callback',
                       status=204)
         SERVICE.start({'polling': False, 'authentication': False})
+        stopped = threading.Event()
 
         def callback(status, data):
             """Callback function"""
             self.assertTrue(isinstance(status, int))
             self.assertTrue(isinstance(data, unicode))
             SERVICE.stop()
+            stopped.set()
 
         DEVICE.read(PATH, callback)
         body = json.dumps(resp['readResponse'])
         conn = httplib.HTTPConnection("localhost", 5725)
         conn.request("PUT", "/notification", body)
         SERVICE.server.join()  # test hold
+        self.assertTrue(stopped.wait(1))
+        conn.close()
+
+    def test_notification_listener(self):
+        """
+        should read whole notification bodies of kept alive connection
+        by Content-Length and chunked transfer encoding
+        """
+        service = Service({'port': 5726})
+        registered = []
+        done = threading.Event()
+
+        def register(name):
+            """Register event listener"""
+            registered.append(name)
+            if len(registered) == 300:
+                done.set()
+        service.on('register', register)
+        service.create_server()
+        service.server.start()
+        batch = {
+            'registrations': [{'name': 'device%d' % i} for i in range(100)],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [],
+        }
+        body = json.dumps(batch)
+        conn = httplib.HTTPConnection('localhost', 5726)
+        for _ in range(2):
+            conn.request('PUT', '/notification', body)
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, 204)
+        conn.close()
+        sock = socket.create_connection(('localhost', 5726))
+        sock.sendall('PUT /notification HTTP/1.1\r\nHost: localhost\r\n'
+                     'Transfer-Encoding: chunked\r\n\r\n' +
+                     '%x\r\n%s\r\n0\r\n\r\n' % (len(body), body))
+        self.assertTrue(sock.recv(1024).startswith('HTTP/1.1 204'))
+        self.assertTrue(done.wait(1))
+        sock.close()
+        service.httpd.shutdown()
+        service.httpd.server_close()
+
+    def test_async_listener(self):
+        """
+        should receive notifications in asyncore event loop
+        """
+        service = Service({
+            'polling': False,
+            'port': 5728,
+            'listener': 'asyncore',
+            'register_callback': False
+        })
+        registered = []
+        service.on('register', registered.append)
+        service.start()
+        loop = threading.Thread(target=asyncore.loop,
+                                kwargs={'timeout': 0.01,
+                                        'map': service.socket_map})
+        loop.start()
+        body = json.dumps(resp['notifications'])
+        conn = httplib.HTTPConnection('localhost', 5728)
+        conn.request('PUT', '/notification', body)
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual(response.status, 204)
+        conn.close()
+        sock = socket.create_connection(('localhost', 5728))
+        sock.sendall('PUT /notification HTTP/1.1\r\nHost: localhost\r\n'
+                     'Transfer-Encoding: chunked\r\n\r\n' +
+                     '%x\r\n%s\r\n0\r\n\r\n' % (len(body), body))
+        self.assertTrue(sock.recv(1024).startswith('HTTP/1.1 204'))
+        sock.close()
+        service.stop()
+        loop.join()
+        self.assertEqual(len(registered), 10)
+
+    def test_async_listener_drain(self):
+        """
+        should hand limited number of received batches to service per loop pass
+        """
+        service = Service({
+            'polling': False,
+            'port': 5731,
+            'listener': 'asyncore',
+            'register_callback': False,
+            'drain_limit': 2
+        })
+        registered = []
+        service.on('register', registered.append)
+        service.start()
+        listener = service.socket_map.values()[0]
+        for _ in range(3):
+            listener.pending.append(resp['notifications'])
+        listener.readable()
+        self.assertEqual(len(registered), 10)
+        service.stop()
+        self.assertEqual(len(registered), 15)
+
+    @responses.activate
+    def test_watchdog_failover(self):
+        """
+        should pull notifications while pushes are missing
+        and stop pulling once pushes resume
+        """
+        empty = {
+            'registrations': [],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [],
+        }
+        responses.add(responses.GET, URL + '/notification/pull',
+                      json=empty, status=200)
+        responses.add(responses.PUT, URL + '/notification/callback',
+                      status=204)
+        responses.add(responses.DELETE, URL + '/notification/callback',
+                      status=204)
+        service = Service({
+            'polling': False,
+            'port': 5729,
+            'interval': 0.01,
+            'watchdog': 0.05
+        })
+        service.start()
+        self.assertFalse(service.pull_event.is_set())
+        time.sleep(0.2)
+        self.assertTrue(service.pull_event.is_set())
+        self.assertEqual(service.metrics['failovers'], 1)
+        pulls = len([call for call in responses.calls
+                     if call.request.method == 'GET'])
+        self.assertTrue(pulls > 0)
+        for _ in range(10):
+            service.receive_notification(empty)
+            time.sleep(0.02)
+        self.assertFalse(service.pull_event.is_set())
+        service.stop()
+        self.assertEqual(service.metrics['failovers'], 1)
+
+    def test_async_receivers(self):
+        """
+        should run asyncore listener in receiver processes
+        """
+        service = Service({
+            'polling': False,
+            'port': 5730,
+            'receivers': 2,
+            'listener': 'asyncore',
+            'register_callback': False
+        })
+        service.start()
+        body = json.dumps(resp['notifications'])
+        for _ in range(4):
+            conn = httplib.HTTPConnection('localhost', 5730)
+            conn.request('PUT', '/notification', body)
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, 204)
+            conn.close()
+        service.stop()
+        self.assertFalse(service.receivers)
+
+    @responses.activate
+    def test_start_receivers(self):
+        """
+        should start receiver processes sharing notification port
+        and register notification callback once
+        """
+        responses.add(responses.PUT, URL + '/notification/callback',
+                      json=resp['registerCallback'], status=204)
+        responses.add(responses.DELETE, URL + '/notification/callback',
+                      status=204)
+        registered = multiprocessing.Queue()
+
+        def handler_factory(service):
+            """Sets up receiver's service"""
+            service.on('register', registered.put)
+        service = Service({
+            'polling': False,
+            'port': 5727,
+            'receivers': 2,
+            'watchdog': 0.05,
+            'handler_factory': handler_factory
+        })
+        service.start()
+        self.assertFalse(service.watchdog_event.is_set())
+        body = json.dumps(resp['notifications'])
+        for _ in range(4):
+            conn = httplib.HTTPConnection('localhost', 5727)
+            conn.request('PUT', '/notification', body)
+            self.assertEqual(conn.getresponse().status, 204)
+            conn.close()
+        names = [registered.get(timeout=1) for _ in range(20)]
+        time.sleep(0.1)
+        service.stop()
+        self.assertEqual(len(set(names)), 5)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertFalse(service.receivers)
 
     @responses.activate
     def test_start_polling_true(self):
@@ -79,7 +288,101 @@ class TestServiceMethods(unittest.TestCase):
                 self.assertTrue(pulled_on_time)
         SERVICE.on('async-response', async_response_callback)
         SERVICE.start({'polling': True, 'interval': chosen_time})
-        SERVICE.pull_timer.join()  # test hold
+        SERVICE.scheduler.join()  # test hold
+
+    @responses.activate
+    def test_start_pipeline(self):
+        """
+        should pull next batch while previous batch is processed
+        """
+        responses.add(responses.GET, URL + '/notification/pull',
+                      json=resp['oneAsyncResponse'], status=200)
+        service = Service({'pipeline': True, 'interval': 0.01})
+        processing = threading.Event()
+        release = threading.Event()
+
+        def async_response_callback(response):
+            """Callback function which holds processing of first batch"""
+            # pylint: disable=unused-argument
+            processing.set()
+            release.wait(1)
+        service.on('async-response', async_response_callback)
+        service.start()
+        self.assertTrue(processing.wait(1))
+        time.sleep(0.1)
+        pulls = len(responses.calls)
+        release.set()
+        service.stop()
+        self.assertEqual(pulls, 2)
+
+    @responses.activate
+    def test_stop_pipeline_from_callback(self):
+        """
+        should stop service from callback in pipeline mode
+        """
+        responses.add(responses.GET, URL + '/notification/pull',
+                      json=resp['oneAsyncResponse'], status=200)
+        service = Service({'pipeline': True, 'interval': 0.01})
+        stopped = threading.Event()
+
+        def async_response_callback(response):
+            """Callback function which stops service"""
+            # pylint: disable=unused-argument
+            time.sleep(0.05)
+            service.stop()
+            stopped.set()
+        service.on('async-response', async_response_callback)
+        service.start()
+        self.assertTrue(stopped.wait(2))
+
+    @responses.activate
+    def test_pull_off_scheduler_thread(self):
+        """
+        should run scheduled jobs while pulled batch is processed
+        """
+        responses.add(responses.GET, URL + '/notification/pull',
+                      json=resp['oneAsyncResponse'], status=200)
+        service = Service({'interval': 10})
+        processing = threading.Event()
+        release = threading.Event()
+        ran = threading.Event()
+
+        def async_response_callback(response):
+            """Callback function which holds processing of batch"""
+            # pylint: disable=unused-argument
+            processing.set()
+            release.wait(1)
+        service.on('async-response', async_response_callback)
+        service.start()
+        self.assertTrue(processing.wait(1))
+        service.scheduler.schedule(0, ran.set)
+        self.assertTrue(ran.wait(0.5))
+        release.set()
+        service.stop()
+
+    def test_adaptive_interval(self):
+        """
+        should back off after empty pulls and tighten after non-empty pulls
+        """
+        service = Service({
+            'adaptive_interval': True,
+            'interval': 1,
+            'min_interval': 0.25,
+            'max_interval': 3,
+            'large_batch': 17
+        })
+        empty = {
+            'registrations': [],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [],
+        }
+        self.assertEqual(service._poll_interval(empty), 2)
+        self.assertEqual(service._poll_interval(None), 3)
+        self.assertEqual(service._poll_interval(resp['oneAsyncResponse']), 1.5)
+        self.assertEqual(service._poll_interval(resp['notifications']), 0)
+        self.assertEqual(service._poll_interval(resp['oneAsyncResponse']), 0.25)
+        self.assertEqual(service.metrics['poll_interval'], 0.25)
 
     # -----------------------pull_notification----------------------------
     @responses.activate
@@ -116,6 +419,230 @@ class TestServiceMethods(unittest.TestCase):
         with self.assertRaises(Exception):
             SERVICE.pull_notification()
 
+    @responses.activate
+    def test_reorder_across_batches(self):
+        """
+        should emit async responses in timestamp order across batches
+        """
+        empty = {
+            'registrations': [],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [],
+        }
+        responses.add(responses.GET, URL + '/notification/pull',
+                      json=empty, status=200)
+        service = Service({
+            'interval': 10,
+            'reorder_lateness': 10,
+            'reorder_interval': 0.02
+        })
+        received = []
+        service.on('async-response',
+                   lambda response: received.append(response['timestamp']))
+        service.start()
+        for timestamps in [[4, 2], [3, 1]]:
+            data = dict(empty)
+            data['async-responses'] = [{'id': str(i), 'timestamp': i}
+                                       for i in timestamps]
+            service._process_events(data)
+        self.assertEqual(received, [])
+        service.reorder.lateness = 0
+        time.sleep(0.1)
+        service.stop()
+        self.assertEqual(received, [1, 2, 3, 4])
+
+    def test_reorder_flushed_on_stop(self):
+        """
+        should deliver async responses held in reorder buffer when stopped
+        """
+        service = Service({'polling': False, 'reorder_lateness': 10})
+        service.reorder = ReorderBuffer(10, 100)
+        received = []
+        service.on('async-response',
+                   lambda response: received.append(response['timestamp']))
+        service._process_events({
+            'registrations': [],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [{'id': '2', 'timestamp': 2},
+                                {'id': '1', 'timestamp': 1}],
+        })
+        self.assertEqual(received, [])
+        service.stop()
+        self.assertEqual(received, [1, 2])
+        self.assertEqual(service.reorder, None)
+
+    def test_default_transaction_timeout(self):
+        """
+        should expire transactions if in-flight cap is configured
+        """
+        service = Service({'max_in_flight': 2})
+        self.assertEqual(service.config['transaction_timeout'], 60.0)
+        service = Service({'max_in_flight': 2, 'transaction_timeout': 5})
+        self.assertEqual(service.config['transaction_timeout'], 5)
+
+    def test_lanes_with_workers(self):
+        """
+        should reject dispatch lanes fed by multiple workers
+        """
+        with self.assertRaises(ValueError):
+            Service({'workers': 2, 'dispatch_lanes': 2})
+        Service({'workers': 1, 'dispatch_lanes': 2})
+
+    def test_duplicate_async_responses(self):
+        """
+        should emit async response with same id and timestamp once
+        """
+        service = Service({'dedup_size': 100})
+        received = []
+        batched = []
+        service.on('async-response',
+                   lambda response: received.append(response['timestamp']))
+        service.on('batch', lambda batch: batched.extend(
+            resp['timestamp'] for resp in batch['async-response'].get(None, [])
+        ))
+        data = {
+            'registrations': [],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [{'id': 'a', 'timestamp': 1},
+                                {'id': 'a', 'timestamp': 2}],
+        }
+        service._process_events(data)
+        service._process_events(data)
+        self.assertEqual(received, [1, 2])
+        self.assertEqual(batched, [1, 2])
+        self.assertEqual(service.metrics['duplicates'], 2)
+
+    @responses.activate
+    def test_compression(self):
+        """
+        should request compressed responses and gzip large request bodies
+        """
+        requests_seen = []
+
+        def callback(request):
+            requests_seen.append(request)
+            return (204, {}, '')
+        responses.add_callback(responses.PUT, URL + '/endpoints/dev/3/0/1',
+                               callback=callback)
+        service = Service({'compression': True,
+                           'compression_threshold': 100})
+        service.put('/endpoints/dev/3/0/1', 'x' * 10)
+        service.put('/endpoints/dev/3/0/1', 'x' * 1000)
+        (small, large) = requests_seen
+        self.assertEqual(small.headers['Accept-Encoding'], 'gzip, deflate')
+        self.assertFalse('Content-Encoding' in small.headers)
+        self.assertEqual(small.body, 'x' * 10)
+        self.assertEqual(large.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(len(large.body) < 100)
+        self.assertEqual(zlib.decompress(large.body, 16 + zlib.MAX_WBITS),
+                         'x' * 1000)
+
+    # -----------------------stream_notification--------------------------
+    def test_iter_sections(self):
+        """
+        should yield items of each section in document order
+        """
+        data = resp['notifications']
+        body = json.dumps(data, indent=1)
+        expected = [(section, item) for section in data
+                    for item in data[section]]
+        items = list(iter_sections(body, 4096))
+        self.assertEqual(items, expected)
+
+    def test_iter_sections_numbers(self):
+        """
+        should not yield number which continues in next chunk
+        """
+        body = '{"async-responses": [1.5, 2e3, 10 ], "x": [1.25]}'
+        expected = [('async-responses', 1.5), ('async-responses', 2e3),
+                    ('async-responses', 10), ('x', 1.25)]
+        for size in range(1, 8):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            self.assertEqual(list(iter_sections(chunks, 4096)), expected)
+
+    def test_iter_sections_buffer(self):
+        """
+        should raise ValueError if item does not fit into buffer
+        or document is incomplete
+        """
+        body = json.dumps(resp['notifications'])
+        with self.assertRaises(ValueError):
+            list(iter_sections(body, 16))
+        with self.assertRaises(ValueError):
+            list(iter_sections([body[:-1]], 4096))
+
+    @responses.activate
+    def test_stream_notification(self):
+        """
+        should dispatch streamed notifications in section order
+        """
+        responses.add(responses.GET, URL + '/notification/pull',
+                      json=resp['notifications'], status=200)
+        service = Service({'streaming': True, 'stream_buffer': 1024})
+        events = []
+        service.on('register', lambda name: events.append('register'))
+        service.on('update', lambda name: events.append('update'))
+        service.on('deregister', lambda name: events.append('deregister'))
+        service.on('async-response',
+                   lambda response: events.append(response))
+        service.pull_event.set()
+        service._pull_and_process()
+        service.stop()
+        data = resp['notifications']
+        for (section, event) in [('registrations', 'register'),
+                                 ('reg-updates', 'update'),
+                                 ('de-registrations', 'deregister')]:
+            self.assertEqual(events.count(event), len(data[section]))
+        self.assertEqual([i for i in events if isinstance(i, dict)],
+                         data['async-responses'])
+
+    @responses.activate
+    def test_stream_notification_workers(self):
+        """
+        should hand streamed notifications to worker pool in small batches
+        """
+        responses.add(responses.GET, URL + '/notification/pull',
+                      json=resp['notifications'], status=200)
+        service = Service({
+            'interval': 10,
+            'streaming': True,
+            'stream_batch': 4,
+            'workers': 1
+        })
+        sizes = []
+        threads = set()
+        done = threading.Event()
+
+        def listener(batch):
+            """Batch listener"""
+            threads.add(threading.current_thread())
+            sizes.append(sum(len(names) for group in batch.values()
+                             for names in group.values()))
+            if sum(sizes) == 17:
+                done.set()
+        service.on_batch(listener)
+        service.start()
+        self.assertTrue(done.wait(1))
+        pull_threads = set(service.puller.threads)
+        service.stop()
+        self.assertEqual(sizes, [4, 4, 4, 4, 1])
+        self.assertEqual(len(threads), 1)
+        self.assertFalse(threads & pull_threads)
+
+    @responses.activate
+    def test_stream_notification_status(self):
+        """
+        shoud raise HTTPError if status code is not 200
+        """
+        responses.add(responses.GET, URL + '/notification/pull',
+                      status=404)
+
+        with self.assertRaisesRegexp(requests.HTTPError, '404'):
+            list(SERVICE.stream_notification())
+
     # --------------------------get_devices------------------------------
     @responses.activate
     def test_get_devices_return(self):
@@ -149,6 +676,84 @@ class TestServiceMethods(unittest.TestCase):
         with self.assertRaises(Exception):
             SERVICE.get_devices()
 
+    @responses.activate
+    def test_get_devices_cached(self):
+        """
+        should serve endpoints from cache until register event invalidates it
+        """
+        responses.add(responses.GET, URL + '/endpoints',
+                      json=resp['endpoints'], status=200)
+        service = Service({'cache': True})
+        service.get_devices()
+        service.get_devices()
+        self.assertEqual(len(responses.calls), 1)
+        service._process_events({
+            'registrations': [{'name': DEVICE_NAME}],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [],
+        })
+        service.get_devices()
+        self.assertEqual(len(responses.calls), 2)
+
+    # -------------------------registry--------------------------------
+    @responses.activate
+    def test_registry(self):
+        """
+        should seed endpoint registry and update it from notifications
+        """
+        responses.add(responses.GET, URL + '/endpoints',
+                      json=resp['endpoints'], status=200)
+        service = Service({'registry': True, 'polling': False})
+        service.registry_event.set()
+        service._resync_registry()
+        service.stop()
+        self.assertEqual(len(service.registry), 5)
+        self.assertEqual(service.registry.get(DEVICE_NAME)['type'], '8dev_3700')
+        service._process_events({
+            'registrations': [{'name': 'newDevice'}],
+            'reg-updates': [],
+            'de-registrations': [{'name': DEVICE_NAME}],
+            'async-responses': [],
+        })
+        self.assertTrue('newDevice' in service.registry)
+        self.assertFalse(DEVICE_NAME in service.registry)
+        self.assertEqual(len(list(service.registry)), 5)
+
+    def test_registry_resync_replay(self):
+        """
+        should replay notifications received during resync
+        """
+        registry = EndpointRegistry()
+        registry.begin_resync()
+        registry.add('newDevice')
+        registry.remove(DEVICE_NAME)
+        registry.finish_resync(resp['endpoints'])
+        self.assertTrue('newDevice' in registry)
+        self.assertFalse(DEVICE_NAME in registry)
+        self.assertEqual(len(registry), 5)
+
+    # -------------------------on_batch--------------------------------
+    @responses.activate
+    def test_on_batch(self):
+        """
+        should deliver whole notification batch grouped by kind and endpoint
+        """
+        responses.add(responses.GET, URL + '/endpoints/' + DEVICE_NAME + PATH,
+                      json=resp['readRequest'], status=202)
+        service = Service()
+        Device(service, DEVICE_NAME).read(PATH)
+        batches = []
+        service.on_batch(batches.append)
+        service._process_events(resp['notifications'])
+        self.assertEqual(len(batches), 1)
+        batch = batches[0]
+        self.assertEqual(sorted(batch['register']),
+                         sorted(i['name'] for i in
+                                resp['notifications']['registrations']))
+        self.assertEqual(len(batch['async-response'][DEVICE_NAME]), 1)
+        self.assertEqual(len(batch['async-response'][None]), 1)
+
     # -------------------------get_version--------------------------------
     @responses.activate
     def test_get_version_return(self):
@@ -423,6 +1028,67 @@ class TestServiceMethods(unittest.TestCase):
                 resp['authentication']['access_token']) != -1)
         SERVICE.stop()
 
+    # ------------------------retry------------------------
+    @responses.activate
+    def test_get_retry(self):
+        """
+        should retry GET request if server is unavailable
+        """
+        responses.add(responses.GET, URL + '/version', status=503)
+        responses.add(responses.GET, URL + '/version',
+                      json=resp['version'], status=200)
+        service = Service({'retries': {'get': 2}, 'retry_backoff': 0.01})
+        self.assertEqual(service.get_version(), '1.0.0')
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_post_not_retried(self):
+        """
+        should not retry POST request which could be processed by server
+        """
+        responses.add(responses.POST, URL + '/endpoints/' + DEVICE_NAME + PATH,
+                      status=502)
+        service = Service({'retries': {'post': 2}, 'retry_backoff': 0.01})
+        response = service.post('/endpoints/' + DEVICE_NAME + PATH)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_circuit_breaker(self):
+        """
+        should fail fast while circuit is open and probe server after timeout
+        """
+        responses.add(responses.GET, URL + '/version', status=500)
+        responses.add(responses.GET, URL + '/version',
+                      json=resp['version'], status=200)
+        service = Service({'breaker_threshold': 1, 'breaker_timeout': 0.05})
+        self.assertEqual(service.get('/version').status_code, 500)
+        with self.assertRaises(CircuitOpenError):
+            service.get_version()
+        time.sleep(0.05)
+        self.assertEqual(service.get_version(), '1.0.0')
+        self.assertEqual(service.breaker.state, 'closed')
+
+    def test_read_timeout(self):
+        """
+        should fail request and record breaker failure
+        if server does not answer within read timeout
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('localhost', 0))
+        server.listen(1)
+        service = Service({
+            'host': 'http://localhost:%d' % server.getsockname()[1],
+            'read_timeout': 0.1,
+            'breaker_threshold': 2
+        })
+        started = time.time()
+        with self.assertRaises(requests.Timeout):
+            service.get('/version')
+        self.assertTrue(time.time() - started < 1)
+        self.assertEqual(service.breaker.failures, 1)
+        server.close()
+
     def test_delete_connection_failed(self):
         """
         shoud raise exception if connection is not succesfull
@@ -436,6 +1102,57 @@ class TestDeviceMethods(unittest.TestCase):
     Tests for Device class
     """
 
+    # --------------------------events-------------------------------
+    def test_events_routed_by_name(self):
+        """
+        should emit register, update and deregister events
+        only on devices of notified endpoint
+        """
+        service = Service()
+        device = Device(service, DEVICE_NAME)
+        other = Device(service, 'fourFive')
+        events = []
+        for event in ['register', 'update', 'deregister']:
+            device.on(event, lambda event=event: events.append(event))
+            other.on(event, lambda: events.append('other'))
+        service._process_events({
+            'registrations': [{'name': DEVICE_NAME}],
+            'reg-updates': [{'name': DEVICE_NAME}],
+            'de-registrations': [{'name': DEVICE_NAME}],
+            'async-responses': [],
+        })
+        self.assertEqual(events, ['register', 'update', 'deregister'])
+        service.remove_device(other)
+        self.assertFalse('fourFive' in service.devices)
+
+    @responses.activate
+    def test_events_dispatch_lanes(self):
+        """
+        should keep order of events of every endpoint
+        when dispatching them on multiple lanes
+        """
+        responses.add(responses.GET, URL + '/notification/pull',
+                      json=resp['notifications'], status=200)
+        service = Service({'dispatch_lanes': 3, 'interval': 123456})
+        events = []
+        done = threading.Event()
+
+        def record(event, name):
+            """Event listener"""
+            events.append((name, event))
+            if len(events) == 15:
+                done.set()
+        service.on('register', lambda name: record('register', name))
+        service.on('update', lambda name: record('update', name))
+        service.on('deregister', lambda name: record('deregister', name))
+        service.start()
+        self.assertTrue(done.wait(1))
+        service.stop()
+        for i in resp['notifications']['registrations']:
+            self.assertEqual([event for (name, event) in events
+                              if name == i['name']],
+                             ['register', 'update', 'deregister'])
+
     # --------------------------get_objects-------------------------------
     @responses.activate
     def test_get_objects_return(self):
@@ -459,6 +1176,22 @@ class TestDeviceMethods(unittest.TestCase):
         with self.assertRaisesRegexp(requests.HTTPError, '404'):
             DEVICE.get_objects()
 
+    @responses.activate
+    def test_get_objects_cached(self):
+        """
+        should serve objects from cache until update event invalidates it
+        """
+        responses.add(responses.GET, URL + '/endpoints/' + DEVICE_NAME,
+                      json=resp['sensorObjects'], status=202)
+        service = Service({'cache': True})
+        device = Device(service, DEVICE_NAME)
+        device.get_objects()
+        device.get_objects()
+        self.assertEqual(len(responses.calls), 1)
+        service.emit('update', name=DEVICE_NAME)
+        device.get_objects()
+        self.assertEqual(len(responses.calls), 2)
+
     def test_get_objects_conn_failed(self):
         """
         shoud raise exception if connection is not succesfull
@@ -497,6 +1230,97 @@ class TestDeviceMethods(unittest.TestCase):
         DEVICE.read(PATH, callback)
         SERVICE._process_events(resp['responsesOfAllOperations'])
 
+    @responses.activate
+    def test_read_coalesced(self):
+        """
+        should join read of the same path which is already in flight
+        """
+        responses.add(responses.GET, URL + '/endpoints/' + DEVICE_NAME + PATH,
+                      json=resp['readRequest'], status=202)
+        service = Service({'coalesce_reads': True})
+        device = Device(service, DEVICE_NAME)
+        statuses = []
+
+        def callback(status, data):
+            """Callback function"""
+            # pylint: disable=unused-argument
+            statuses.append(status)
+
+        first_id = device.read(PATH, callback)
+        second_id = device.read(PATH, callback)
+        self.assertEqual(first_id, second_id)
+        self.assertEqual(len(responses.calls), 1)
+        service._process_events(resp['responsesOfAllOperations'])
+        self.assertEqual(statuses, [200, 200])
+        self.assertFalse(device.reads)
+
+    @responses.activate
+    def test_read_routed_by_id(self):
+        """
+        should route async response by id and drop finished transaction
+        """
+        responses.add(responses.GET, URL + '/endpoints/' + DEVICE_NAME + PATH,
+                      json=resp['readRequest'], status=202)
+        service = Service()
+        device = Device(service, DEVICE_NAME)
+        async_id = device.read(PATH)
+        self.assertEqual(service.routes[async_id][0], device)
+        service._process_events(resp['responsesOfAllOperations'])
+        self.assertFalse(service.routes)
+        self.assertFalse(device.transactions)
+
+    @responses.activate
+    def test_read_timeout(self):
+        """
+        should call callback with timeout status if response does not arrive
+        """
+        responses.add(responses.GET, URL + '/endpoints/' + DEVICE_NAME + PATH,
+                      json=resp['readRequest'], status=202)
+        service = Service({'transaction_timeout': 0})
+        device = Device(service, DEVICE_NAME)
+        statuses = []
+
+        def callback(status, data):
+            """Callback function"""
+            statuses.append(status)
+            self.assertEqual(data, None)
+
+        device.read(PATH, callback)
+        service._expire_transactions()
+        self.assertEqual(statuses, [504])
+        self.assertFalse(device.transactions)
+        self.assertEqual(service.routes.expired, 1)
+
+    @responses.activate
+    def test_read_timeout_dispatched(self):
+        """
+        should call timeout callback on dispatch lane of device
+        """
+        responses.add(responses.GET, URL + '/endpoints/' + DEVICE_NAME + PATH,
+                      json=resp['readRequest'], status=202)
+        responses.add(responses.GET, URL + '/notification/pull', status=200,
+                      json={'registrations': [], 'reg-updates': [],
+                            'de-registrations': [], 'async-responses': []})
+        service = Service({'transaction_timeout': 0, 'dispatch_lanes': 2,
+                           'interval': 123456, 'expiry_interval': 123456})
+        device = Device(service, DEVICE_NAME)
+        threads = []
+        done = threading.Event()
+
+        def callback(status, data):
+            """Callback function"""
+            # pylint: disable=unused-argument
+            threads.append(threading.current_thread())
+            done.set()
+
+        service.start()
+        device.read(PATH, callback)
+        service._expire_transactions()
+        self.assertTrue(done.wait(1))
+        lanes = [thread for lane in service.lanes for thread in lane.threads]
+        service.stop()
+        self.assertIn(threads[0], lanes)
+
     @responses.activate
     def test_read_wrong_status(self):
         """
@@ -630,6 +1454,9 @@ class TestDeviceMethods(unittest.TestCase):
         id_regex = '^\\d+#[0-9a-z]{8}-[0-9a-z]{4}-[0-9a-z]{4}-[0-9a-z]{4}-[0-9a-z]{4}$'
         response = DEVICE.observe(PATH)
         self.assertRegexpMatches(response, id_regex)
+        responses.add(responses.DELETE,
+                      URL + '/subscriptions/' + DEVICE_NAME + PATH, status=204)
+        DEVICE.cancel_observe(PATH)
 
     @responses.activate
     def test_observe_callback_data(self):
@@ -655,6 +1482,99 @@ class TestDeviceMethods(unittest.TestCase):
 
         DEVICE.observe(PATH, callback)
         SERVICE._process_events(resp['responsesOfAllOperations'])
+        responses.add(responses.DELETE,
+                      URL + '/subscriptions/' + DEVICE_NAME + PATH, status=204)
+        DEVICE.cancel_observe(PATH)
+
+    @responses.activate
+    def test_observe_conflated(self):
+        """
+        should deliver only the latest notification of a batch
+        """
+        responses.add(responses.PUT, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+                      json=resp['observeRequest'], status=202)
+        service = Service()
+        device = Device(service, DEVICE_NAME)
+        payloads = []
+        device.observe(PATH, lambda status, data: payloads.append(data), True)
+        async_id = resp['observeRequest']['async-response-id']
+        service._process_events({
+            'registrations': [],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [
+                {'timestamp': 3, 'id': async_id, 'status': 200, 'payload': 'c'},
+                {'timestamp': 1, 'id': async_id, 'status': 200, 'payload': 'a'},
+                {'timestamp': 2, 'id': async_id, 'status': 200, 'payload': 'b'},
+            ],
+        })
+        self.assertEqual(payloads, ['c'])
+        self.assertEqual(service.metrics['conflated'], 2)
+
+    @responses.activate
+    def test_observe_conflated_window(self):
+        """
+        should deliver only the latest notification of a time window
+        """
+        responses.add(responses.PUT, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+                      json=resp['observeRequest'], status=202)
+        service = Service()
+        device = Device(service, DEVICE_NAME)
+        payloads = []
+        device.observe(PATH, lambda status, data: payloads.append(data), 0.05)
+        async_id = resp['observeRequest']['async-response-id']
+        for (timestamp, payload) in [(1, 'a'), (2, 'b')]:
+            service._process_events({
+                'registrations': [],
+                'reg-updates': [],
+                'de-registrations': [],
+                'async-responses': [{
+                    'timestamp': timestamp, 'id': async_id,
+                    'status': 200, 'payload': payload
+                }],
+            })
+        self.assertEqual(payloads, [])
+        time.sleep(0.1)
+        self.assertEqual(payloads, ['b'])
+        self.assertEqual(service.metrics['conflated'], 1)
+
+    @responses.activate
+    def test_observe_conflated_window_stop(self):
+        """
+        should deliver notification held for conflation window on stop
+        """
+        responses.add(responses.PUT, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+                      json=resp['observeRequest'], status=202)
+        responses.add(responses.GET, URL + '/notification/pull', status=200,
+                      json={'registrations': [], 'reg-updates': [],
+                            'de-registrations': [], 'async-responses': []})
+        service = Service({'dispatch_lanes': 2, 'interval': 123456})
+        device = Device(service, DEVICE_NAME)
+        payloads = []
+        threads = []
+
+        def callback(status, data):
+            """Callback function"""
+            # pylint: disable=unused-argument
+            payloads.append(data)
+            threads.append(threading.current_thread())
+        device.observe(PATH, callback, 10)
+        service.start()
+        service._process_events({
+            'registrations': [],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [{
+                'timestamp': 1, 'id': resp['observeRequest']['async-response-id'],
+                'status': 200, 'payload': 'a'
+            }],
+        })
+        lanes = [thread for lane in service.lanes for thread in lane.threads]
+        service.stop()
+        for thread in lanes:
+            thread.join(1)
+        self.assertEqual(payloads, ['a'])
+        self.assertIn(threads[0], lanes)
 
     @responses.activate
     def test_observe_wrong_status(self):
@@ -696,13 +1616,246 @@ class TestDeviceMethods(unittest.TestCase):
         response = DEVICE.cancel_observe(PATH)
         self.assertTrue(response == 204)
 
+    @responses.activate
+    def test_cancel_observe_cleanup(self):
+        """
+        should remove subscription and it's callback when observation is cancelled
+        """
+        responses.add(responses.PUT, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+                      json=resp['observeRequest'], status=202)
+        responses.add(responses.DELETE,
+                      URL + '/subscriptions/' + DEVICE_NAME + PATH, status=204)
+        service = Service()
+        device = Device(service, DEVICE_NAME)
+        device.observe(PATH, lambda status, data: None)
+        device.cancel_observe(PATH)
+        self.assertFalse(device.subscriptions)
+        self.assertFalse(device.observations)
+        self.assertFalse(service.routes)
+
+    @responses.activate
+    def test_observe_during_cancel(self):
+        """
+        should start new subscription when path is observed while cancelling
+        """
+        observed = []
+        service = Service()
+        device = Device(service, DEVICE_NAME)
+
+        def unsubscribe(request):
+            """Observes path again while cancel request is in flight"""
+            # pylint: disable=unused-argument
+            observed.append(device.observe(PATH, lambda status, data: None))
+            return (204, {}, '')
+        responses.add(responses.PUT, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+                      json=resp['observeRequest'], status=202)
+        responses.add_callback(
+            responses.DELETE, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+            callback=unsubscribe)
+        callback = lambda status, data: None
+        device.observe(PATH, callback)
+        self.assertEqual(device.cancel_observe(PATH, callback), 204)
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(len(device.subscriptions[PATH]['callbacks']), 1)
+        self.assertEqual(list(device.observations), observed)
+
+    @responses.activate
+    def test_resubscribe(self):
+        """
+        should re-issue observations keeping callbacks when device registers
+        """
+        responses.add(responses.PUT, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+                      json=resp['observeRequest'], status=202)
+        service = Service({'resubscribe': True})
+        device = Device(service, DEVICE_NAME)
+
+        def callback(status, data):
+            """Callback function"""
+            # pylint: disable=unused-argument
+            pass
+
+        device.observe(PATH, callback)
+        service._process_events({
+            'registrations': [{'name': DEVICE_NAME}],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [],
+        })
+        for _ in range(100):
+            if len(responses.calls) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(device.subscriptions[PATH]['callbacks'], [callback])
+        self.assertEqual(len(service.routes), 1)
+        self.assertEqual(len(service.resubscriber.threads), 1)
+        service.stop()
+
+    @responses.activate
+    def test_resubscribe_cancelled(self):
+        """
+        should not keep observation which is cancelled while it is re-issued
+        """
+        service = Service()
+        device = Device(service, DEVICE_NAME)
+        subscribed = []
+
+        def subscribe(request):
+            """Cancels observation while it is re-issued"""
+            # pylint: disable=unused-argument
+            subscribed.append(True)
+            if len(subscribed) == 2:
+                device.cancel_observe(PATH)
+            return (202, {}, json.dumps(resp['observeRequest']))
+        responses.add_callback(
+            responses.PUT, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+            callback=subscribe)
+        responses.add(responses.DELETE,
+                      URL + '/subscriptions/' + DEVICE_NAME + PATH, status=204)
+        device.observe(PATH, lambda status, data: None)
+        device.resubscribe()
+        self.assertEqual(
+            sorted(call.request.method for call in responses.calls),
+            ['DELETE', 'DELETE', 'PUT', 'PUT'])
+        self.assertFalse(device.subscriptions)
+        self.assertFalse(device.observations)
+        self.assertFalse(service.routes)
+
+    @responses.activate
+    def test_observe_shared(self):
+        """
+        should share server subscription between callbacks of the same path
+        """
+        responses.add(responses.PUT, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+                      json=resp['observeRequest'], status=202)
+        responses.add(responses.DELETE,
+                      URL + '/subscriptions/' + DEVICE_NAME + PATH, status=204)
+        service = Service()
+        device = Device(service, DEVICE_NAME)
+        calls = []
+
+        def first(status, data):
+            """Callback function"""
+            # pylint: disable=unused-argument
+            calls.append('first')
+
+        def second(status, data):
+            """Callback function"""
+            # pylint: disable=unused-argument
+            calls.append('second')
+
+        first_id = device.observe(PATH, first)
+        self.assertEqual(device.observe(PATH, second), first_id)
+        service._process_events(resp['responsesOfAllOperations'])
+        self.assertEqual(sorted(calls), ['first', 'second'])
+        self.assertEqual(device.cancel_observe(PATH, first), None)
+        self.assertEqual(device.cancel_observe(PATH, second), 204)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertFalse(service.routes)
+
+    @responses.activate
+    def test_observe_concurrent(self):
+        """
+        should send one subscription request for concurrent first observers
+        """
+        started = threading.Event()
+        release = threading.Event()
+
+        def subscribe(request):
+            """Holds subscription request until second observer joins"""
+            # pylint: disable=unused-argument
+            started.set()
+            release.wait(1)
+            return (202, {}, json.dumps(resp['observeRequest']))
+        responses.add_callback(
+            responses.PUT, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+            callback=subscribe)
+        responses.add(responses.DELETE,
+                      URL + '/subscriptions/' + DEVICE_NAME + PATH, status=204)
+        service = Service()
+        device = Device(service, DEVICE_NAME)
+        ids = []
+        thread = threading.Thread(target=lambda: ids.append(
+            device.observe(PATH, lambda status, data: None)))
+        thread.start()
+        self.assertTrue(started.wait(1))
+        joiner = threading.Thread(target=lambda: ids.append(
+            device.observe(PATH, lambda status, data: None)))
+        joiner.start()
+        time.sleep(0.05)
+        release.set()
+        thread.join()
+        joiner.join()
+        self.assertEqual(len(set(ids)), 1)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(len(device.subscriptions[PATH]['callbacks']), 2)
+        self.assertEqual(device.cancel_observe(PATH), 204)
+
+    @responses.activate
+    def test_observe_conflation_conflict(self):
+        """
+        should reject observer whose conflation differs from subscription
+        """
+        responses.add(responses.PUT, URL + '/subscriptions/' + DEVICE_NAME + PATH,
+                      json=resp['observeRequest'], status=202)
+        responses.add(responses.DELETE,
+                      URL + '/subscriptions/' + DEVICE_NAME + PATH, status=204)
+        service = Service()
+        device = Device(service, DEVICE_NAME)
+        async_id = device.observe(PATH, lambda status, data: None)
+        with self.assertRaises(ValueError):
+            device.observe(PATH, lambda status, data: None, True)
+        self.assertEqual(service.routes[async_id][3], None)
+        self.assertEqual(len(device.subscriptions[PATH]['callbacks']), 1)
+        self.assertEqual(device.cancel_observe(PATH), 204)
+
+    @responses.activate
+    def test_transaction_held_in_handler(self):
+        """
+        should hold transaction started by event handler at in-flight cap
+        and send it when slot is released
+        """
+        ids = iter(['id0', 'id1'])
+        responses.add_callback(
+            responses.GET, URL + '/endpoints/' + DEVICE_NAME + PATH,
+            callback=lambda request: (
+                202, {}, json.dumps({'async-response-id': next(ids)})))
+        service = Service({'max_in_flight': 1})
+        device = Device(service, DEVICE_NAME)
+        statuses = []
+        started = []
+
+        def on_register(name):
+            """Starts two reads from event handler"""
+            # pylint: disable=unused-argument
+            started.append(device.read(PATH, lambda status, data:
+                                       statuses.append(('first', status))))
+            started.append(device.read(PATH, lambda status, data:
+                                       statuses.append(('second', status))))
+        service.on('register', on_register)
+        batch = {
+            'registrations': [{'name': DEVICE_NAME}],
+            'reg-updates': [],
+            'de-registrations': [],
+            'async-responses': [],
+        }
+        service._process_events(batch)
+        self.assertEqual(started, ['id0', None])
+        self.assertEqual(len(responses.calls), 1)
+        batch['registrations'] = []
+        batch['async-responses'] = [{'id': 'id0', 'status': 200,
+                                     'timestamp': 1}]
+        service._process_events(batch)
+        self.assertEqual(len(responses.calls), 2)
+        batch['async-responses'] = [{'id': 'id1', 'status': 200,
+                                     'timestamp': 2}]
+        service._process_events(batch)
+        self.assertEqual(statuses, [('first', 200), ('second', 200)])
+        self.assertEqual(service.limiter.in_flight, {})
+
     def test_cancel_observe_conn_failed(self):
         """
         shoud raise exception if connection is not succesfull
         """
         with self.assertRaises(Exception):
             DEVICE.cancel_observe(PATH)
-
-
-if __name__ == '__main__':
-    unittest.main()
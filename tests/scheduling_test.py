@@ -0,0 +1,78 @@
+"""Tests for `scheduling.py`."""
+
+import unittest
+import time
+import threading
+from scheduling import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    """
+    Tests for Scheduler class
+    """
+
+    def test_deadline_order(self):
+        """
+        should run jobs in deadline order on a single thread
+        """
+        scheduler = Scheduler()
+        calls = []
+        done = threading.Event()
+        scheduler.schedule(0.04, done.set)
+        scheduler.schedule(0.02, lambda: calls.append(threading.current_thread()))
+        scheduler.schedule(0.01, lambda: calls.append(threading.current_thread()))
+        self.assertTrue(done.wait(1))
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(calls[0] is calls[1])
+        scheduler.stop()
+
+    def test_periodic_job(self):
+        """
+        should schedule job from running job relative to it's deadline
+        """
+        scheduler = Scheduler()
+        deadlines = []
+
+        def job():
+            """Periodic job"""
+            deadlines.append(scheduler.current.deadline)
+            if len(deadlines) < 3:
+                scheduler.schedule_periodic(0.02, job)
+        scheduler.schedule(0, job)
+        time.sleep(0.2)
+        self.assertEqual(len(deadlines), 3)
+        self.assertAlmostEqual(deadlines[2] - deadlines[0], 0.04, places=6)
+
+    def test_one_shot_job(self):
+        """
+        should schedule one-shot job from running job relative to now
+        """
+        scheduler = Scheduler()
+        done = threading.Event()
+        started = []
+
+        def job():
+            """Slow job"""
+            time.sleep(0.05)
+            started.append(time.time())
+            scheduler.schedule(0.05, done.set)
+        scheduler.schedule(0, job)
+        self.assertTrue(done.wait(1))
+        self.assertTrue(time.time() - started[0] >= 0.045)
+        scheduler.stop()
+
+    def test_stop(self):
+        """
+        should cancel scheduled jobs when stopped
+        """
+        scheduler = Scheduler()
+        calls = []
+        job = scheduler.schedule(0.02, calls.append, 1)
+        scheduler.stop()
+        time.sleep(0.05)
+        self.assertTrue(job.cancelled)
+        self.assertEqual(calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+"""Tests for `stores.py`."""
+
+import unittest
+from stores import TransactionStore
+
+
+class TestTransactionStore(unittest.TestCase):
+    """
+    Tests for TransactionStore class
+    """
+
+    def test_expire(self):
+        """
+        should expire only entries which deadline has passed
+        """
+        store = TransactionStore()
+        store.add('expiring', 1, 0)
+        store.add('live', 2, 60)
+        store.add('observation', 3)
+        store.add('answered', 4, 0)
+        store.pop('answered')
+        self.assertEqual(store.expire(), [('expiring', 1)])
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.expired, 1)
+        self.assertEqual(store['live'], 2)